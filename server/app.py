@@ -4,13 +4,29 @@ from flasgger import Swagger
 from flask import Flask
 
 from blueprints.api import api as api_blueprint
-from blueprints.api.subsonic.play import check_queue_and_play
+
+# The package attribute named subsonic is shadowed by the blueprint module of the same name
+from blueprints.api.subsonic.subsonic import subsonic_client as subsonic
+from blueprints.api.subsonic.play import check_queue_and_play, player
+from utils.player_ipc import PlayerClient
 
 
 def create_app() -> Flask:
     app = Flask(__name__)
     swagger = Swagger(app)
     app.register_blueprint(api_blueprint, url_prefix="/api")
+    subsonic.auth.start()
+    subsonic.health.start()
+    if isinstance(player, PlayerClient):
+        player.start()
+    else:
+        # Scrobbles are sent by the process that plays the songs
+        subsonic.scrobbler.start()
+        # Workers refresh the playlists on lookup rather than each polling the server
+        subsonic.playlists.start()
+    if subsonic.library is not None:
+        # Only one worker syncs, the others search the mirror it keeps
+        subsonic.library.start()
     return app
 
 
@@ -0,0 +1,105 @@
+"""
+Compares the build time and memory of the song models against eager, unslotted models that
+store their full stream and cover URLs, the way songs used to be built.
+
+Run from the server directory with a utils/config.py in place:
+
+    python3 -m benchmarks.models
+"""
+
+import gc
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable
+
+from utils.subsonic import Subsonic
+
+from .wire_format import song_attrib
+
+
+@dataclass()
+class EagerSong:
+    title: str
+    stream_url: str
+    artist: str
+    album: str
+    cover: str
+    duration: str
+    track: str
+    year: str
+    genre: str
+    id: str
+
+
+def build_eager_song(client: Subsonic, attrib: dict[str, str]) -> EagerSong:
+    return EagerSong(
+        title=attrib.get("title"),
+        stream_url=client.build_url("/stream", {**client.params, "id": attrib["id"]}),
+        artist=attrib.get("artist"),
+        album=attrib.get("album"),
+        cover=client.build_url(
+            "/getCoverArt", {**client.params, "id": attrib.get("coverArt")}
+        ),
+        duration=attrib.get("duration"),
+        track=attrib.get("track"),
+        year=attrib.get("year"),
+        genre=attrib.get("genre"),
+        id=attrib.get("id"),
+    )
+
+
+def make_attribs(count: int) -> list[dict[str, str]]:
+    """Attributes of songs with fresh string copies, as the response parsers produce"""
+
+    return [
+        {name: str(value) for name, value in song_attrib(index).items()}
+        for index in range(count)
+    ]
+
+
+def measure(build: Callable[[dict], object], count: int) -> tuple[float, int]:
+    """Returns the best build time of the songs in seconds and the bytes the songs keep
+    once the parsed attributes are dropped"""
+
+    attribs = make_attribs(count)
+    build_time = min(
+        timeit.repeat(lambda: [build(attrib) for attrib in attribs], number=1, repeat=5)
+    )
+    del attribs
+
+    gc.collect()
+    tracemalloc.start()
+    attribs = make_attribs(count)
+    songs = [build(attrib) for attrib in attribs]
+    del attribs
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del songs
+    return build_time, size
+
+
+def main() -> None:
+    client = Subsonic()
+    count = 100_000
+
+    print(f"{count} songs")
+    for name, build in {
+        "eager": lambda attrib: build_eager_song(client, attrib),
+        "lazy": client.build_song,
+    }.items():
+        build_time, size = measure(build, count)
+        print(
+            f"  {name:<5} build {build_time * 1000:8.1f} ms"
+            f"  memory {size / 1024**2:8.1f} MiB"
+        )
+
+    attrib = make_attribs(1)[0]
+    assert client.build_song(attrib).stream_url == (
+        build_eager_song(client, attrib).stream_url
+    )
+
+
+if __name__ == "__main__":
+    main()
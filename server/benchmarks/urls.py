@@ -0,0 +1,60 @@
+"""
+Compares the cost of building the stream and cover URLs of a 10k song result by encoding the
+credentials for every URL, the way URLs used to be built, against the pre-encoded credentials
+of Auth, with and without a fresh salt per URL.
+
+Run from the server directory with a utils/config.py in place:
+
+    python3 -m benchmarks.urls
+"""
+
+import timeit
+import urllib.parse
+from typing import Callable
+
+from utils.authentication import Auth
+from utils.subsonic import Links, Subsonic
+
+from .models import make_attribs
+
+
+def main() -> None:
+    client = Subsonic()
+    count = 10_000
+    songs = [client.build_song(attrib) for attrib in make_attribs(count)]
+    params = client.params
+
+    def encode_every_url() -> None:
+        for song in songs:
+            urllib.parse.urlencode({**params, "id": song.id})
+            urllib.parse.urlencode({**params, "id": song.cover_id})
+
+    def links_of(auth: Auth) -> Callable[[], None]:
+        links = Links(client.url, auth)
+
+        def build() -> None:
+            for song in songs:
+                links.stream(song.id)
+                links.cover(song.cover_id)
+
+        return build
+
+    fixed = Auth("user", "password")
+    # Holds enough credentials for every run, like a pool refilled between bursts
+    pooled = Auth("user", "password", pool_size=2 * count * 5)
+    # Never refilled, every URL hashes its own credentials
+    drained = Auth("user", "password", pool_size=1)
+
+    print(f"{count} songs, stream and cover URLs")
+    for name, build in {
+        "encode every URL": encode_every_url,
+        "pre-encoded, one salt": links_of(fixed),
+        "pre-encoded, pooled salts": links_of(pooled),
+        "hashed per URL": links_of(drained),
+    }.items():
+        build_time = min(timeit.repeat(build, number=1, repeat=5))
+        print(f"  {name:<26} {build_time * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
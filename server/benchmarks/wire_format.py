@@ -0,0 +1,129 @@
+"""
+Compares the parse and model build time of XML and JSON responses of the Subsonic API.
+
+Run from the server directory with a utils/config.py in place:
+
+    python3 -m benchmarks.wire_format
+"""
+
+import json
+import timeit
+import xml.etree.ElementTree as ET
+
+from utils.subsonic import Subsonic
+
+NAMESPACE = "http://subsonic.org/restapi"
+
+
+def song_attrib(index: int) -> dict:
+    return {
+        "id": f"song-{index}",
+        "parent": f"album-{index // 12}",
+        "isDir": False,
+        "title": f"Song number {index}",
+        "album": f"Album number {index // 12}",
+        "artist": f"Artist number {index // 120}",
+        "track": index % 12 + 1,
+        "year": 2000 + index % 24,
+        "genre": "Pop",
+        "coverArt": f"al-{index // 12}",
+        "size": 8_000_000 + index,
+        "contentType": "audio/mpeg",
+        "suffix": "mp3",
+        "duration": 180 + index % 120,
+        "bitRate": 320,
+        "path": f"Artist number {index // 120}/Album number {index // 12}/{index}.mp3",
+        "albumId": f"album-{index // 12}",
+        "artistId": f"artist-{index // 120}",
+        "type": "music",
+    }
+
+
+def album_attrib(index: int) -> dict:
+    return {
+        "id": f"album-{index}",
+        "name": f"Album number {index}",
+        "artist": f"Artist number {index // 10}",
+        "artistId": f"artist-{index // 10}",
+        "coverArt": f"al-{index}",
+        "songCount": 12,
+        "duration": 2400,
+        "year": 2000 + index % 24,
+        "genre": "Pop",
+        "created": "2024-01-01T00:00:00Z",
+    }
+
+
+def xml_value(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def xml_body(key: str, children: dict[str, list[dict]]) -> bytes:
+    root = ET.Element("subsonic-response", status="ok", version="1.16.1")
+    root.set("xmlns", NAMESPACE)
+    payload = ET.SubElement(root, key)
+    for tag, items in children.items():
+        for item in items:
+            ET.SubElement(
+                payload, tag, {name: xml_value(value) for name, value in item.items()}
+            )
+    return ET.tostring(root)
+
+
+def json_body(key: str, children: dict[str, list[dict]]) -> bytes:
+    return json.dumps(
+        {"subsonic-response": {"status": "ok", "version": "1.16.1", key: children}}
+    ).encode("utf-8")
+
+
+def main() -> None:
+    client = Subsonic()
+
+    payloads = {
+        "search3 (500 songs, 100 albums)": (
+            "searchResult3",
+            {
+                "song": [song_attrib(index) for index in range(500)],
+                "album": [album_attrib(index) for index in range(100)],
+            },
+        ),
+        "getPlaylist (10000 entries)": (
+            "playlist",
+            {"entry": [song_attrib(index) for index in range(10000)]},
+        ),
+    }
+
+    for name, (key, children) in payloads.items():
+        bodies = {
+            "xml": xml_body(key, children),
+            "json": json_body(key, children),
+        }
+        parsers = {"xml": client.parse_xml, "json": client.parse_json}
+
+        print(name)
+        for wire_format, body in bodies.items():
+            parse = parsers[wire_format]
+
+            def parse_and_build() -> None:
+                data = parse(body, key)
+                for song in data.get("song", []) + data.get("entry", []):
+                    client.build_song(song)
+                for album in data.get("album", []):
+                    client.build_album(album)
+
+            runs = 5
+            parse_time = min(
+                timeit.repeat(lambda: parse(body, key), number=1, repeat=runs)
+            )
+            total_time = min(timeit.repeat(parse_and_build, number=1, repeat=runs))
+            print(
+                f"  {wire_format:<4} {len(body) / 1024:8.0f} KiB"
+                f"  parse {parse_time * 1000:8.2f} ms"
+                f"  parse + build {total_time * 1000:8.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
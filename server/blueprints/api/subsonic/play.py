@@ -1,18 +1,37 @@
-import random
-import time
-
-import vlc
-from flask import Blueprint, abort, request
+from flask import Blueprint, abort, make_response, request
 
+from utils.config import SUBSONIC_CONFIG as CONFIG
+from utils.player_ipc import PlayerClient, PlayerUnavailable
 from . import subsonic, logger
+from .serializers import song_to_dict
 
 play = Blueprint("play", __name__)
 
-music_queue = []
-current_song = None
-player = vlc.Instance()
-media_player = player.media_player_new()
-media_player.audio_set_volume(50)
+player_config: dict = CONFIG.get("player", {})
+if player_config.get("socket"):
+    # Playback runs in the player daemon, this process only handles requests
+    player = PlayerClient(
+        player_config["socket"],
+        subsonic.links,
+        authkey=(player_config.get("authKey") or "").encode("utf-8") or None,
+        event_buffer=player_config.get("eventBuffer", 64),
+    )
+else:
+    # Imported here so API workers do not need VLC
+    from utils.player_service import PlayerService
+
+    player = PlayerService(
+        subsonic,
+        logger,
+        prebuffer_seconds=player_config.get("preBufferSeconds", 10),
+        event_buffer=player_config.get("eventBuffer", 64),
+    )
+
+
+@play.errorhandler(PlayerUnavailable)
+def player_unavailable(e: PlayerUnavailable):
+    logger.error(f"Failed to reach the player daemon: {e}")
+    return "Failed to reach the player daemon", 503
 
 
 @play.route("/song", methods=["POST"])
@@ -45,7 +64,7 @@ def play_song():
     data = request.get_json()
     query: str = data.get("query")
     track_id: str = data.get("id")
-    if not query and not id:
+    if not query and not track_id:
         return abort(400, "No song name or id was provided.")
     if track_id:
         logger.info(f"Attempting to play song with id {track_id}")
@@ -55,20 +74,22 @@ def play_song():
             return abort(
                 404, "The song you are looking for could not be found on the server."
             )
-        s = song[0]
-        music_queue.append(s)
-        return f"Added {s.title} by {s.artist} to the queue"
+        player.enqueue([song])
+        return f"Added {song.title} by {song.artist} to the queue"
     elif query:
         logger.info(f"Attempting to play {query}")
-        song = subsonic.search_song(query)
+        songs = subsonic.search_song(query)
+        # Known songs are matched locally when the search finds nothing, which tolerates
+        # typos in voice transcriptions
+        song = songs[0] if songs else subsonic.match_song(query)
         if not song:
             logger.warn(f"Failed to play {query}")
             return abort(
-                404, "The song you are looking for could not be found on the server."
+                404,
+                "The song you are looking for could not be found on the server.",
             )
-        s = song[0]
-        music_queue.append(s)
-        return f"Added {s.title} by {s.artist} to the queue"
+        player.enqueue([song])
+        return f"Added {song.title} by {song.artist} to the queue"
 
 
 @play.route("/album", methods=["POST"])
@@ -111,20 +132,74 @@ def play_album():
             return abort(
                 404, "The album you are looking for could not be found on the server."
             )
-        music_queue.extend(album.songs)
+        player.enqueue(album.songs)
         return f"Added songs from {album.title} by {album.artist} to the queue"
     elif query:
         logger.info(f"Attempting to play {query}")
         album = subsonic.search_album(query)
+        if album:
+            # Search results do not include the songs of the album
+            album = subsonic.get_album(album.id)
+        else:
+            # Known albums are matched locally when the search finds nothing
+            album = subsonic.match_album(query)
         if not album:
             logger.warn(f"Failed to play {query}")
             return abort(
-                404, "The album you are looking for could not be found on the server."
+                404,
+                "The album you are looking for could not be found on the server.",
             )
-        music_queue.extend(album.songs)
+        player.enqueue(album.songs)
         return f"Added songs from {album.title} by {album.artist} to the queue"
 
 
+@play.route("/playlist", methods=["POST"])
+def play_playlist():
+    """
+    Play a playlist by searching for the playlist name or providing the playlist id.
+    ID takes precedence over query. The whole playlist is added to the queue at once.
+    ---
+    tags:
+      - subsonic
+    parameters:
+        - in: body
+          name: body
+          required: true
+          schema:
+            type: object
+            properties:
+              query:
+                type: string
+              id:
+                type: string
+    responses:
+        200:
+            description: The playlist was successfully added to the queue
+        400:
+            description: No playlist name or id was provided
+        404:
+            description: The playlist you are looking for could not be found on the server
+    """
+    data = request.get_json()
+    query: str = data.get("query")
+    playlist_id: str = data.get("id")
+    if not query and not playlist_id:
+        return abort(400, "No playlist name or id was provided.")
+    if playlist_id:
+        logger.info(f"Attempting to play playlist with id {playlist_id}")
+        songs = subsonic.get_playlist(playlist_id)
+    else:
+        logger.info(f"Attempting to play {query}")
+        songs = subsonic.search_playlist(query)
+    if not songs:
+        logger.warn(f"Failed to play {query or playlist_id}")
+        return abort(
+            404, "The playlist you are looking for could not be found on the server."
+        )
+    player.enqueue(songs)
+    return f"Added {len(songs)} songs from the playlist to the queue"
+
+
 @play.route("/next", methods=["POST"])
 def next_song():
     """
@@ -138,9 +213,7 @@ def next_song():
         404:
             description: No song is currently playing
     """
-    if media_player.is_playing():
-        logger.info("Skipping the current song")
-        media_player.stop()
+    if player.skip():
         return "Skipped the current song"
     else:
         logger.warn("No song is currently playing")
@@ -150,10 +223,28 @@ def next_song():
 @play.route("/queue", methods=["GET"])
 def queue():
     """
-    Get the current queue
+    Get a page of the current queue.
+    The response carries an ETag of the queue version, send it back in If-None-Match to get a
+    304 while the queue is unchanged.
     ---
     tags:
       - subsonic
+    parameters:
+      - name: offset
+        in: query
+        type: integer
+        required: false
+        description: Number of songs to skip, relative to the cursor if one is given
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Maximum number of songs to return, defaults to 50 and is kept between 1 and 500
+      - name: cursor
+        in: query
+        type: integer
+        required: false
+        description: Start right after the queue entry with this cursor, as returned in next
     responses:
         200:
             description: The current queue
@@ -165,6 +256,8 @@ def queue():
                         items:
                             type: object
                             properties:
+                                cursor:
+                                    type: integer
                                 title:
                                     type: string
                                 artist:
@@ -175,6 +268,8 @@ def queue():
                                     type: string
                                 cover:
                                     type: string
+                                stream:
+                                    type: string
                                 duration:
                                     type: string
                                 genre:
@@ -183,25 +278,46 @@ def queue():
                                     type: string
                                 id:
                                     type: string
-        404:
-            description: The queue is empty
+                    total:
+                        type: integer
+                    version:
+                        type: integer
+                    next:
+                        type: integer
+                        description: Cursor of the last returned song, null at the end
+        304:
+            description: The queue has not changed since the ETag was issued
+        400:
+            description: The offset, limit or cursor is not a valid integer
     """
-    return {
-        "queue": [
-            {
-                "title": song.title,
-                "artist": song.artist,
-                "album": song.album,
-                "track": song.track,
-                "cover": song.cover,
-                "duration": song.duration,
-                "genre": song.genre,
-                "year": song.year,
-                "id": song.id,
-            }
-            for song in music_queue[:50]
-        ]
-    }
+    try:
+        offset = max(int(request.args.get("offset", 0)), 0)
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+        cursor = request.args.get("cursor")
+        cursor = int(cursor) if cursor is not None else None
+    except ValueError:
+        return abort(400, "The offset, limit and cursor must be integers.")
+
+    # Cheap check before building the page, the ETag only depends on the queue version
+    etag = player.queue_etag()
+    if request.if_none_match.contains(etag):
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    entries, start, total, version, etag = player.queue_page(offset, limit, cursor)
+    response = make_response(
+        {
+            "queue": [
+                {"cursor": sequence, **song_to_dict(song)} for sequence, song in entries
+            ],
+            "total": total,
+            "version": version,
+            "next": (
+                entries[-1][0] if entries and start + len(entries) < total else None
+            ),
+        }
+    )
+    response.set_etag(etag)
+    return response
 
 
 @play.route("/shuffle", methods=["POST"])
@@ -216,7 +332,7 @@ def shuffle():
             description: Shuffled the queue
     """
     logger.info("Shuffling the queue")
-    random.shuffle(music_queue)
+    player.shuffle()
     return "Shuffled the queue"
 
 
@@ -232,7 +348,7 @@ def clear():
             description: Cleared the queue
     """
     logger.info("Cleared the queue")
-    music_queue.clear()
+    player.clear()
     return "Cleared the queue"
 
 
@@ -249,9 +365,8 @@ def toggle_playback():
         204:
             description: No song is currently playing
     """
-    out = media_player.pause()
-    if out == 0:
-        return f"Toggled the playback of the current song {out}"
+    if player.toggle_pause():
+        return "Toggled the playback of the current song"
     else:
         return abort(204, "No song is currently playing")
 
@@ -288,53 +403,22 @@ def volume():
     """
     # Volume should ideally be changed via the hosts volume control. Whilst this does work,
     # it is not recommended to be used as it can significantly decrease the quality of the audio.
+    if request.method == "GET":
+        return {"volume": player.volume()}
+
     data = request.get_json()
     change = data.get("amount", 0)
     set = data.get("set", False)
-    if request.method == "GET":
-        return {media_player.audio_get_volume()}
 
     if change != 0:
-        new_volume = media_player.audio_get_volume() + change if not set else change
-        if new_volume > 200:
-            new_volume = 200
-        elif new_volume < 0:
-            new_volume = 0
-        media_player.audio_set_volume(new_volume)
+        new_volume = player.change_volume(change, set=set)
         return f"Volume is now {new_volume}"
 
-    return f"Volume is {media_player.audio_get_volume()}"
+    return f"Volume is {player.volume()}"
 
 
 def check_queue_and_play():
-    global media_player
-    global music_queue
-    global current_song
-    scrobbled = False
-
-    while True:
-        length = media_player.get_length() / 1000
-        current_time = media_player.get_time() / 1000
-        if (
-            not media_player.is_playing()
-            and len(music_queue) > 0
-            and media_player.get_state() != vlc.State.Paused
-        ):
-            current_song = music_queue.pop(0)
-            media = player.media_new(current_song.stream_url)
-            media_player.set_media(media)
-            media_player.play()
-            subsonic.scrobble(current_song.id, False)
-            scrobbled = False
-            logger.info(
-                f"Now playing {current_song.title} | {current_song.artist} | {current_song.album}"
-            )
-        elif (
-            media_player.is_playing()
-            and (current_time / length) > 0.5
-            and not scrobbled
-        ):
-            subsonic.scrobble(current_song.id, True)
-            scrobbled = True
-        else:
-            time.sleep(1)
+    if isinstance(player, PlayerClient):
+        logger.info("Playback is handled by the player daemon")
+        return
+    player.run()
@@ -1,6 +1,7 @@
 from flask import Blueprint, abort, request
 
 from . import logger, subsonic
+from .serializers import cover_url, stream_url
 
 search = Blueprint("search", __name__)
 
@@ -46,6 +47,8 @@ def search_query():
                         type: string
                       cover:
                         type: string
+                      stream:
+                        type: string
                       duration:
                         type: string
                       genre:
@@ -119,7 +122,8 @@ def search_query():
                         "artist": song.artist,
                         "album": song.album,
                         "track": song.track,
-                        "cover": song.cover,
+                        "cover": cover_url(song.cover_id),
+                        "stream": stream_url(song.id),
                         "duration": song.duration,
                         "genre": song.genre,
                         "year": song.year,
@@ -141,7 +145,7 @@ def search_query():
                     {
                         "title": album.title,
                         "artist": album.artist,
-                        "cover": album.cover,
+                        "cover": cover_url(album.cover_id),
                         "id": album.id,
                     }
                     for album in (albums if albums is not None else [])
@@ -164,7 +168,7 @@ def search_query():
                         "albums": [
                             {
                                 "title": album.title,
-                                "cover": album.cover,
+                                "cover": cover_url(album.cover_id),
                                 "id": album.id,
                                 "year": album.year,
                                 "genre": album.genre,
@@ -176,9 +180,7 @@ def search_query():
                 ]
             }
         case _:
-            songs = subsonic.search_song(query, single=False)
-            albums = subsonic.search_album(query, single=False)
-            artists = subsonic.search_artist(query)
+            result = subsonic.search_all(query)
             return {
                 "songs": [
                     {
@@ -186,32 +188,42 @@ def search_query():
                         "artist": song.artist,
                         "album": song.album,
                         "track": song.track,
-                        "cover": song.cover,
+                        "cover": cover_url(song.cover_id),
+                        "stream": stream_url(song.id),
                         "duration": song.duration,
                         "genre": song.genre,
                         "year": song.year,
                         "id": song.id,
                     }
-                    for song in (songs if songs is not None else [])
+                    for song in result.songs
                 ],
                 "albums": [
                     {
                         "title": album.title,
                         "artist": album.artist,
-                        "cover": album.cover,
+                        "cover": cover_url(album.cover_id),
                         "id": album.id,
                         "year": album.year,
                         "genre": album.genre,
                     }
-                    for album in (albums if albums is not None else [])
+                    for album in result.albums
                 ],
                 "artists": [
                     {
                         "name": artist.name,
                         "id": artist.id,
-                        "albums": artist.albums,
+                        "albums": [
+                            {
+                                "title": album.title,
+                                "cover": cover_url(album.cover_id),
+                                "id": album.id,
+                                "year": album.year,
+                                "genre": album.genre,
+                            }
+                            for album in artist.albums
+                        ],
                     }
-                    for artist in (artists if artists is not None else [])
+                    for artist in result.artists
                 ],
             }
 
@@ -269,7 +281,7 @@ def get_artist(id: str):
         "albums": [
             {
                 "title": album.title,
-                "cover": album.cover,
+                "cover": cover_url(album.cover_id),
                 "id": album.id,
             }
             for album in (artist.albums if artist.albums is not None else [])
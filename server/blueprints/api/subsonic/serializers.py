@@ -0,0 +1,34 @@
+from flask import url_for
+
+from utils.subsonic import Song
+
+
+def cover_url(cover_id: str | None, size: int | None = None) -> str | None:
+    """Absolute URL of a cover on the cover art proxy, which never exposes credentials"""
+
+    if cover_id is None:
+        return None
+    return url_for("api.subsonic.cover", id=cover_id, size=size, _external=True)
+
+
+def stream_url(id: str) -> str:
+    """Absolute URL of a song on the stream proxy, which never exposes credentials"""
+
+    return url_for("api.subsonic.stream", id=id, _external=True)
+
+
+def song_to_dict(song: Song) -> dict:
+    """Serialize a Song model for an API response"""
+
+    return {
+        "title": song.title,
+        "artist": song.artist,
+        "album": song.album,
+        "track": song.track,
+        "cover": cover_url(song.cover_id),
+        "stream": stream_url(song.id),
+        "duration": song.duration,
+        "genre": song.genre,
+        "year": song.year,
+        "id": song.id,
+    }
@@ -1,18 +1,65 @@
-from flask import Blueprint, abort
+import json
+import os
 
+import requests
+from flask import Blueprint, Response, abort, request, send_file, stream_with_context
+
+from utils.subsonic import Song, SubsonicError
 from . import subsonic as subsonic_client, logger
-from .play import play as play_blueprint
+from .play import play as play_blueprint, player
 from .search import search as search_blueprint
+from .serializers import cover_url, song_to_dict, stream_url
 
 subsonic = Blueprint("subsonic", __name__)
 subsonic.register_blueprint(play_blueprint, url_prefix="/play")
 subsonic.register_blueprint(search_blueprint, url_prefix="/search")
 
+# Endpoints that must stay reachable while the Subsonic server is marked as down
+HEALTH_EXEMPT_ENDPOINTS = {
+    "api.subsonic.index",
+    "api.subsonic.stats",
+    # Cached covers and tracks are served while the server is down
+    "api.subsonic.cover",
+    "api.subsonic.stream",
+    # Player events and controls that only touch the local player
+    "api.subsonic.events",
+    "api.subsonic.play.queue",
+    "api.subsonic.play.volume",
+    "api.subsonic.play.next_song",
+    "api.subsonic.play.toggle_playback",
+    "api.subsonic.play.shuffle",
+    "api.subsonic.play.clear",
+}
+
+# Largest edge in pixels a cover can be resized to
+MAX_COVER_SIZE = 2048
+# Seconds browsers and embed proxies may reuse a cover without revalidating it
+COVER_MAX_AGE = 86400
+
+# Size of the chunks relayed from the server, a stream never holds more than one in memory
+STREAM_CHUNK_SIZE = 64 * 1024
+# Request headers forwarded to the server so it can answer range and conditional requests
+STREAM_REQUEST_HEADERS = ("Range", "If-Range")
+# Response headers relayed from the server
+STREAM_RESPONSE_HEADERS = (
+    "Content-Type",
+    "Content-Length",
+    "Content-Range",
+    "Accept-Ranges",
+    "ETag",
+    "Last-Modified",
+)
+
+# Seconds between comments sent on an idle event stream, which detect closed connections
+EVENTS_HEARTBEAT = 15
+# Milliseconds browsers wait before reconnecting to a dropped event stream
+EVENTS_RETRY = 3000
+
 
 @subsonic.before_request
 def before_request():
     """
-    Checks if the Subsonic server is reachable before each request
+    Fails fast if the Subsonic server was last seen as unreachable
     ---
     tags:
      - subsonic
@@ -20,19 +67,19 @@ def before_request():
       503:
         description: Failed to connect to Subsonic server
     """
-    try:
-        logger.info("Attempting to connect to Subsonic server")
-        if not subsonic_client.ping():
-            logger.warn("Failed to connect to Subsonic server")
-            return abort(500, "Failed to connect to Subsonic server")
-        else:
-            logger.info("Connected to Subsonic server")
-    except Exception:  # noqa
-        # We use a broad exception as there are a variety of Connection* errors that can be raised
-        logger.warn("Failed to connect to Subsonic server")
+    if request.endpoint in HEALTH_EXEMPT_ENDPOINTS:
+        return
+    if not subsonic_client.health.up:
+        logger.warn("Subsonic server is marked as unreachable")
         return abort(503, "Failed to connect to Subsonic server")
 
 
+@subsonic.errorhandler(SubsonicError)
+def subsonic_error(e: SubsonicError):
+    logger.error(f"The Subsonic server returned an error: {e}")
+    return "The Subsonic server returned an error", 502
+
+
 @subsonic.route("/", methods=["GET"])
 def index():
     """
@@ -46,9 +93,342 @@ def index():
       503:
         description: Failed to connect to Subsonic server
     """
+    logger.info("Attempting to connect to Subsonic server")
+    if not subsonic_client.health.check():
+        logger.warn("Failed to connect to Subsonic server")
+        return abort(503, "Failed to connect to Subsonic server")
+    logger.info("Connected to Subsonic server")
     return "Connected to Subsonic server"
 
 
+@subsonic.route("/stats", methods=["GET"])
+def stats():
+    """
+    Gets runtime statistics of the Subsonic client
+    ---
+    tags:
+     - subsonic
+    responses:
+        200:
+            description: The client statistics
+            content:
+            application/json:
+                schema:
+                type: object
+                properties:
+                    transport:
+                    type: object
+                    properties:
+                        requests:
+                        type: integer
+                        connections:
+                        type: integer
+                        reused:
+                        type: integer
+                    auth:
+                    type: object
+                    description: Pool level and credentials issued when rotating salts
+                    health:
+                    type: object
+                    properties:
+                        up:
+                        type: boolean
+                        lastChecked:
+                        type: number
+                        lastError:
+                        type: string
+                    metadataCache:
+                    type: object
+                    description: Hits, misses and evictions of the memory and disk tiers
+                    searchCache:
+                    type: object
+                    description: Hits, misses, evictions and hits on cached empty results
+                    fuzzy:
+                    type: object
+                    description: Size of the typo tolerant index of known titles
+                    audioCache:
+                    type: object
+                    description: Size, hit rate and bytes served locally by the audio cache
+                    library:
+                    type: object
+                    description: Size and sync state of the local library mirror, if enabled
+                    coverCache:
+                    type: object
+                    description: Size, hit rate and resizes of the cover art cache
+                    scrobbler:
+                    type: object
+                    description: Pending, sent, rejected and superseded scrobbles
+                    events:
+                    type: object
+                    description: Subscribers, published and dropped player events
+    """
+    return {
+        "transport": subsonic_client.transport.stats(),
+        "auth": subsonic_client.auth.stats(),
+        "health": subsonic_client.health.status(),
+        "metadataCache": subsonic_client.metadata_cache.stats(),
+        "searchCache": subsonic_client.search_cache.stats(),
+        "fuzzy": subsonic_client.fuzzy.stats(),
+        "audioCache": (
+            subsonic_client.audio_cache.stats()
+            if subsonic_client.audio_cache is not None
+            else None
+        ),
+        "library": (
+            subsonic_client.library.stats()
+            if subsonic_client.library is not None
+            else None
+        ),
+        "scrobbler": subsonic_client.scrobbler.stats(),
+        "coverCache": subsonic_client.cover_cache.stats(),
+        "events": player.events.stats(),
+    }
+
+
+@subsonic.route("/events", methods=["GET"])
+def events():
+    """
+    Streams player events as Server-Sent Events
+    The stream starts with the current state, the latest event of every type, followed by
+    every change. Song data uses the same fields as the search results.
+    ---
+    tags:
+     - subsonic
+    produces:
+     - text/event-stream
+    responses:
+        200:
+            description: |
+                An event stream with these event types
+                - track: {"song": object or null} when a song starts or the queue runs out
+                - pause: {"paused": boolean}
+                - volume: {"volume": integer}
+                - queue: {"version": integer, "length": integer} when the queue changes
+    """
+    subscription = player.events.subscribe()
+
+    def generate():
+        with subscription:
+            yield f"retry: {EVENTS_RETRY}\n\n"
+            while True:
+                batch = subscription.get(EVENTS_HEARTBEAT)
+                if not batch:
+                    yield ": keepalive\n\n"
+                for event in batch:
+                    data = {
+                        key: song_to_dict(value) if isinstance(value, Song) else value
+                        for key, value in event.data.items()
+                    }
+                    yield (
+                        f"id: {event.id}\nevent: {event.type}\n"
+                        f"data: {json.dumps(data)}\n\n"
+                    )
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        # Stops proxies from buffering or caching the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@subsonic.route("/cover/<string:id>", methods=["GET"])
+def cover(id: str):
+    """
+    Gets cover art from the local cover cache, fetching it from the server on a miss
+    ---
+    tags:
+     - subsonic
+    parameters:
+      - name: id
+        in: path
+        type: string
+        required: true
+        description: The cover art ID of the song or album
+      - name: size
+        in: query
+        type: integer
+        required: false
+        description: Largest edge in pixels, the original image is served without it
+    responses:
+        200:
+            description: The image, with an ETag and Cache-Control headers
+        304:
+            description: The image has not changed since the given ETag
+        400:
+            description: Invalid size
+        404:
+            description: The cover art could not be found
+        503:
+            description: The cover is not cached and the Subsonic server is unreachable
+    """
+    size = request.args.get("size")
+    if size is not None:
+        try:
+            size = int(size)
+        except ValueError:
+            return abort(400, "size must be an integer")
+        if not 0 < size <= MAX_COVER_SIZE:
+            return abort(400, f"size must be between 1 and {MAX_COVER_SIZE}")
+
+    cover_cache = subsonic_client.cover_cache
+    path = cover_cache.lookup(id, size)
+    if path is None:
+        if not subsonic_client.health.up:
+            logger.warn("Subsonic server is marked as unreachable")
+            return abort(503, "Failed to connect to Subsonic server")
+        path = cover_cache.fetch(id, size)
+    if path is None:
+        return abort(404, "The cover art could not be found on the server.")
+
+    # The file name is unique to the cover and size, the modification time is not stable as
+    # it tracks the last use
+    etag = f"{os.path.basename(path)}-{os.path.getsize(path)}"
+    response = send_file(path, etag=etag, max_age=COVER_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    return response
+
+
+@subsonic.route("/stream/<string:id>", methods=["GET"])
+def stream(id: str):
+    """
+    Streams a song without exposing credentials, with support for range requests
+    ---
+    tags:
+     - subsonic
+    parameters:
+      - name: id
+        in: path
+        type: string
+        required: true
+        description: The ID of the song
+      - name: maxBitRate
+        in: query
+        type: integer
+        required: false
+        description: Passed to the server to transcode the song to at most this bit rate
+      - name: format
+        in: query
+        type: string
+        required: false
+        description: Passed to the server to transcode the song to this format
+    responses:
+        200:
+            description: The audio
+        206:
+            description: The requested range of the audio
+        304:
+            description: The audio has not changed since the given ETag
+        400:
+            description: Invalid maxBitRate
+        404:
+            description: The song could not be found
+        416:
+            description: The requested range is not satisfiable
+        502:
+            description: The Subsonic server answered with an error other than not found
+        503:
+            description: The song is not cached and the Subsonic server is unreachable
+    """
+    transcoding = {}
+    if request.args.get("maxBitRate") is not None:
+        try:
+            transcoding["maxBitRate"] = int(request.args["maxBitRate"])
+        except ValueError:
+            return abort(400, "maxBitRate must be an integer")
+    if request.args.get("format"):
+        transcoding["format"] = request.args["format"]
+
+    audio_cache = subsonic_client.audio_cache
+    # The cache holds the original files, transcoded streams always come from the server
+    if audio_cache is not None and not transcoding:
+        path = audio_cache.lookup(id)
+        if path is not None:
+            return send_cached_track(path)
+
+    if not subsonic_client.health.up:
+        logger.warn("Subsonic server is marked as unreachable")
+        return abort(503, "Failed to connect to Subsonic server")
+
+    headers = {
+        name: request.headers[name]
+        for name in STREAM_REQUEST_HEADERS
+        if name in request.headers
+    }
+    try:
+        upstream = subsonic_client.request(
+            "/stream",
+            {**subsonic_client.params, **transcoding, "id": id},
+            stream=True,
+            headers=headers,
+        )
+    except requests.RequestException:
+        logger.warn(f"Failed to stream song with id {id}")
+        return abort(503, "Failed to connect to Subsonic server")
+    if upstream.status_code != 416 and not subsonic_client.is_media(upstream):
+        not_found = subsonic_client.is_not_found(upstream)
+        upstream.close()
+        logger.warn(f"Failed to stream song with id {id}")
+        if not_found:
+            return abort(
+                404, "The song you are looking for could not be found on the server."
+            )
+        return abort(502, "The Subsonic server returned an error")
+
+    chunks = upstream.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+    if audio_cache is not None and not transcoding:
+        # Serve the next request for the song from disk. A full stream is written to the
+        # cache as it is relayed, a range is downloaded again in the background
+        if upstream.status_code == 200 and "Range" not in headers:
+            chunks = audio_cache.tee(id, chunks, upstream.headers.get("Content-Type"))
+        else:
+            audio_cache.prefetch(id)
+
+    response_headers = {
+        name: upstream.headers[name]
+        for name in STREAM_RESPONSE_HEADERS
+        if name in upstream.headers
+    }
+    if upstream.headers.get("Content-Encoding", "identity") != "identity":
+        # The body is relayed decoded, so its length differs from the upstream one
+        response_headers.pop("Content-Length", None)
+
+    def relay():
+        try:
+            yield from chunks
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            upstream.close()
+
+    return Response(
+        stream_with_context(relay()),
+        status=upstream.status_code,
+        headers=response_headers,
+        direct_passthrough=True,
+    )
+
+
+def send_cached_track(path: str) -> Response:
+    """Serve a track from the audio cache with the content type the server sent it with.
+    Ranges and conditional requests are answered locally and the WSGI server can send the
+    file without copying it through Python"""
+
+    # Cached tracks never change, the modification time is not stable as it tracks the last use
+    etag = f"{os.path.basename(path)}-{os.path.getsize(path)}"
+    response = send_file(
+        path,
+        mimetype=subsonic_client.audio_cache.content_type(path)
+        or "application/octet-stream",
+        etag=etag,
+        conditional=True,
+    )
+    if response.status_code in (200, 206):
+        # Only count the bytes of the answered range, a 304 has no body
+        subsonic_client.audio_cache.served(response.content_length or 0)
+    return response
+
+
 @subsonic.route("/now_playing", methods=["GET"])
 def now_playing():
     """
@@ -74,6 +454,8 @@ def now_playing():
                     type: string
                     cover:
                     type: string
+                    stream:
+                    type: string
                     duration:
                     type: integer
                     genre:
@@ -94,7 +476,8 @@ def now_playing():
         "artist": song.artist,
         "album": song.album,
         "track": song.track,
-        "cover": song.cover,
+        "cover": cover_url(song.cover_id),
+        "stream": stream_url(song.id),
         "duration": song.duration,
         "genre": song.genre,
         "year": song.year,
@@ -0,0 +1,44 @@
+"""
+Player daemon, owns VLC and the queue when the API runs in several worker processes.
+
+Set player.socket in utils/config.py, start this script once and then start the API workers,
+which send their playback commands to the daemon over the socket.
+"""
+
+from colorama import Fore
+
+from utils.config import SUBSONIC_CONFIG as CONFIG
+from utils.logging import Logger
+from utils.player_ipc import PlayerServer
+from utils.player_service import PlayerService
+from utils.subsonic import Subsonic
+
+if __name__ == "__main__":
+    player_config: dict = CONFIG.get("player", {})
+    if not player_config.get("socket"):
+        raise SystemExit(
+            "Set player.socket in utils/config.py to run the player daemon"
+        )
+
+    subsonic = Subsonic()
+    logger = Logger("Player", Fore.LIGHTCYAN_EX)
+
+    service = PlayerService(
+        subsonic,
+        logger,
+        prebuffer_seconds=player_config.get("preBufferSeconds", 10),
+        event_buffer=player_config.get("eventBuffer", 64),
+    )
+    server = PlayerServer(
+        service,
+        player_config["socket"],
+        subsonic.links,
+        logger,
+        authkey=(player_config.get("authKey") or "").encode("utf-8") or None,
+    )
+
+    subsonic.auth.start()
+    subsonic.health.start()
+    subsonic.scrobbler.start()
+    server.start()
+    service.run()
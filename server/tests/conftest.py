@@ -0,0 +1,35 @@
+import os
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+# The server is run from its own directory, which holds the top level packages
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# utils/config.py is not committed and VLC needs a native library, neither is needed here
+config = types.ModuleType("utils.config")
+config.SUBSONIC_CONFIG = {
+    "subsonicUrl": "http://subsonic.invalid",
+    "user": {"username": "test", "password": "test"},
+}
+sys.modules["utils.config"] = config
+sys.modules["vlc"] = mock.MagicMock()
+
+
+@pytest.fixture
+def app():
+    from flask import Flask
+
+    from blueprints.api import api
+
+    # Background threads of create_app are left out, the health state stays up
+    app = Flask(__name__)
+    app.register_blueprint(api, url_prefix="/api")
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
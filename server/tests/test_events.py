@@ -0,0 +1,33 @@
+from utils.events import EventBus
+
+
+def test_dropped_events_are_counted_after_the_subscriber_leaves():
+    bus = EventBus(buffer_size=2)
+    subscription = bus.subscribe()
+
+    for index in range(5):
+        bus.publish("track", {"index": index})
+
+    assert subscription.dropped == 3
+    assert bus.stats()["dropped"] == 3
+
+    subscription.close()
+
+    assert bus.stats() == {"subscribers": 0, "published": 5, "dropped": 3}
+
+
+def test_lagged_subscriber_gets_the_latest_state():
+    bus = EventBus(buffer_size=2)
+    bus.publish("volume", {"volume": 50})
+    subscription = bus.subscribe()
+
+    for index in range(3):
+        bus.publish("track", {"index": index})
+
+    events = subscription.get(timeout=0)
+
+    assert [event.data for event in events] == [
+        {"index": 1},
+        {"index": 2},
+        {"volume": 50},
+    ]
@@ -0,0 +1,38 @@
+from blueprints.api.subsonic.play import player
+from utils.subsonic import Song
+
+
+def make_song(index: int) -> Song:
+    return Song(
+        title=f"Song {index}",
+        artist="Artist",
+        album="Album",
+        duration="200",
+        track=str(index),
+        year="2020",
+        genre="Pop",
+        id=f"s{index}",
+    )
+
+
+def test_queue_limit_zero_returns_one_entry(client):
+    player.queue.clear()
+    player.queue.extend(make_song(index) for index in range(3))
+
+    response = client.get("/api/subsonic/play/queue?limit=0")
+
+    assert response.status_code == 200
+    assert len(response.json["queue"]) == 1
+    assert response.json["next"] == response.json["queue"][0]["cursor"]
+    assert response.json["total"] == 3
+
+
+def test_queue_past_the_end_has_no_next(client):
+    player.queue.clear()
+    player.queue.extend(make_song(index) for index in range(3))
+
+    response = client.get("/api/subsonic/play/queue?offset=10")
+
+    assert response.status_code == 200
+    assert response.json["queue"] == []
+    assert response.json["next"] is None
@@ -0,0 +1,64 @@
+from utils.player_commands import MAX_VOLUME, MIN_VOLUME, ChangeVolume, Mailbox
+
+
+def apply(volume: int, commands: list[ChangeVolume]) -> int:
+    """Volume after running the commands one by one, as the player does"""
+
+    for command in commands:
+        volume = command.amount if command.set else volume + command.amount
+        volume = min(max(volume, MIN_VOLUME), MAX_VOLUME)
+    return volume
+
+
+def submit(commands: list[ChangeVolume]) -> list[ChangeVolume]:
+    mailbox = Mailbox(lambda: None)
+    for command in commands:
+        mailbox.submit(command)
+    return [command for command, _ in mailbox.drain()]
+
+
+def test_opposite_steps_are_not_merged():
+    commands = [ChangeVolume(-100), ChangeVolume(100)]
+
+    merged = submit(commands)
+
+    assert merged == commands
+    assert apply(50, merged) == apply(50, commands) == 100
+
+
+def test_same_way_steps_are_merged():
+    commands = [ChangeVolume(150), ChangeVolume(100)]
+
+    merged = submit(commands)
+
+    assert merged == [ChangeVolume(250)]
+    assert apply(50, merged) == apply(50, commands) == MAX_VOLUME
+
+
+def test_step_after_set_is_added_to_the_clamped_volume():
+    commands = [ChangeVolume(-50, set=True), ChangeVolume(30)]
+
+    merged = submit(commands)
+
+    assert merged == [ChangeVolume(30, set=True)]
+    assert apply(100, merged) == apply(100, commands) == 30
+
+
+def test_newer_set_wins():
+    commands = [ChangeVolume(-100), ChangeVolume(80, set=True)]
+
+    merged = submit(commands)
+
+    assert merged == [ChangeVolume(80, set=True)]
+    assert apply(50, merged) == apply(50, commands) == 80
+
+
+def test_merged_futures_get_the_result():
+    mailbox = Mailbox(lambda: None)
+    futures = [mailbox.submit(ChangeVolume(10)), mailbox.submit(ChangeVolume(5))]
+
+    [(command, command_futures)] = mailbox.drain()
+
+    assert command == ChangeVolume(15)
+    assert command_futures == futures
+    assert mailbox.stats()["coalesced"] == 1
@@ -0,0 +1,404 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, TypeVar
+
+import aiohttp
+
+from .cache import MISSING
+from .config import SUBSONIC_CONFIG as CONFIG
+from .subsonic import (
+    NOT_FOUND,
+    Album,
+    Artist,
+    SearchResult,
+    Song,
+    Subsonic,
+    SubsonicError,
+)
+from .transport import NON_IDEMPOTENT_ROUTES
+
+T = TypeVar("T")
+
+
+def encode_params(params: dict) -> list[tuple[str, str]]:
+    """Flatten parameters into the pairs aiohttp accepts, repeating keys of list values the
+    same way requests does"""
+
+    pairs: list[tuple[str, str]] = []
+    for key, value in params.items():
+        for item in value if isinstance(value, list) else (value,):
+            pairs.append((key, str(item)))
+    return pairs
+
+
+class AsyncSubsonic:
+    """
+    Asynchronous client of the Subsonic API, for frontends that run many lookups at once on
+    a single thread.
+
+    It sits on top of a Subsonic client and shares its credentials, caches, fuzzy index,
+    library mirror, health state and model builders, so results are the same as from the
+    blocking client. Requests go through a pooled aiohttp session, which must be created and
+    closed in the event loop that uses it:
+
+        async with AsyncSubsonic() as client:
+            song, album = await asyncio.gather(
+                client.get_song(song_id), client.get_album(album_id)
+            )
+    """
+
+    def __init__(self, client: Subsonic | None = None) -> None:
+        self.client: Subsonic = client if client is not None else Subsonic()
+
+        http_config: dict = CONFIG.get("http", {})
+        self.pool_size: int = http_config.get("poolSize", 10)
+        self.timeout: aiohttp.ClientTimeout = aiohttp.ClientTimeout(
+            sock_connect=http_config.get("connectTimeout", 3.05),
+            sock_read=http_config.get("readTimeout", 10),
+        )
+        self.retries: int = http_config.get("retries", 3)
+        self.backoff: float = http_config.get("backoff", 0.3)
+
+        self.session: aiohttp.ClientSession | None = None
+        self.requests: int = 0
+
+        self.info: Callable[[str], None] = self.client.info
+        self.warn: Callable[[str], None] = self.client.warn
+        self.error: Callable[[str], None] = self.client.error
+
+    async def __aenter__(self) -> "AsyncSubsonic":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=self.timeout,
+            )
+        return self.session
+
+    @property
+    def params(self) -> dict[str, str]:
+        return self.client.params
+
+    async def request(self, subroute: str, params: dict) -> bytes:
+        """
+        Generic request to the Subsonic API returning the body, the outcome updates the
+        health state. Idempotent routes are retried on connection errors and gateway errors
+        with exponential backoff, like the blocking transport.
+
+        Subroute should come in the format of /subroute, with the slash ahead of it.
+        """
+
+        attempts = 1 if subroute in NON_IDEMPOTENT_ROUTES else self.retries + 1
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            self.requests += 1
+            try:
+                # Built like the model URLs, as base_url rejects a server under a path
+                async with self.get_session().get(
+                    f"{self.client.url}/rest{subroute}", params=encode_params(params)
+                ) as r:
+                    if r.status in (502, 503, 504) and attempt + 1 < attempts:
+                        continue
+                    body = await r.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt + 1 < attempts:
+                    continue
+                self.client.health.report_failure(str(e) or type(e).__name__)
+                raise
+
+            if r.status >= 500:
+                self.client.health.report_failure(
+                    f"{subroute} returned status {r.status}"
+                )
+            else:
+                self.client.health.report_success()
+            # Same as the blocking client, anything but a Subsonic response is an error
+            r.raise_for_status()
+            return body
+
+    async def data_request(
+        self, subroute: str, params: dict, key: str | None = None
+    ) -> dict:
+        """
+        Generic request to the Subsonic API in the configured wire format.
+
+        Returns the payload under key, or the top level attributes of the response if no key
+        is given, in the same shape and with the same errors as Subsonic.data_request.
+        """
+
+        if self.client.format == "json":
+            body = await self.request(subroute, {**params, "f": "json"})
+            return self.client.parse_json(body, key)
+
+        body = await self.request(subroute, params)
+        return self.client.parse_xml(body, key)
+
+    async def hydrate(
+        self,
+        fetch: Callable[[str], Awaitable[T]],
+        ids: list[str],
+        concurrency: int | None = None,
+        deadline: float | None = None,
+    ) -> list[T]:
+        """
+        Resolve a list of IDs with fetch concurrently, keeping the order of the IDs.
+
+        Lookups that fail or miss the deadline are logged and left out of the result.
+        """
+
+        semaphore = asyncio.Semaphore(concurrency or self.client.hydration_concurrency)
+        deadline = deadline if deadline is not None else self.client.hydration_deadline
+
+        async def limited(id: str) -> T:
+            async with semaphore:
+                return await fetch(id)
+
+        tasks = [asyncio.ensure_future(limited(id)) for id in ids]
+        if tasks:
+            await asyncio.wait(tasks, timeout=deadline)
+
+        hydrated: list[T] = []
+        for id, task in zip(ids, tasks):
+            if not task.done():
+                task.cancel()
+                self.warn(f'Failed to hydrate "{id}": Deadline exceeded')
+            elif task.exception() is not None:
+                self.warn(f'Failed to hydrate "{id}": {task.exception()}')
+            elif task.result() is not None:
+                hydrated.append(task.result())
+
+        return hydrated
+
+    async def ping(self) -> bool:
+        """Test if the server is online and return true only if the status is ok"""
+
+        try:
+            await self.data_request("/ping", self.params)
+        except SubsonicError:
+            return False
+        return True
+
+    async def cached(
+        self, kind: str, id: str, subroute: str, cache: bool = True
+    ) -> dict:
+        """Fetch the raw data of an item by its ID through the shared metadata cache. Raises
+        SubsonicError if the server did not return the item, which is never cached"""
+
+        key = f"{kind}:{id}"
+        # The cache may be backed by SQLite, which would block the event loop
+        metadata_cache = self.client.metadata_cache
+        data = await asyncio.to_thread(metadata_cache.get, key) if cache else MISSING
+        if data is MISSING:
+            data = await self.data_request(subroute, {**self.params, "id": id}, kind)
+            await asyncio.to_thread(metadata_cache.set, key, data)
+        self.client.remember(kind, data)
+
+        return data
+
+    async def get_album(self, id: str, cache: bool = True) -> Album | None:
+        """Generates an Album model, or None if the server did not return the album"""
+
+        try:
+            album_data: dict = await self.cached("album", id, "/getAlbum", cache)
+        except SubsonicError as e:
+            self.warn(f'Failed to get the album "{id}": {e}')
+            return None
+
+        return self.client.build_full_album(album_data)
+
+    async def get_song(self, id: str, cache: bool = True) -> Song | None:
+        """Generates a Song model by its ID, or None if the server did not return the song"""
+
+        try:
+            song_data: dict = await self.cached("song", id, "/getSong", cache)
+        except SubsonicError as e:
+            self.warn(f'Failed to get the song "{id}": {e}')
+            return None
+
+        return self.client.build_song(song_data)
+
+    async def get_artist(self, id: str, cache: bool = True) -> Artist | None:
+        """Generates an Artist model by its ID, or None if the server did not return the
+        artist"""
+
+        try:
+            artist_data: dict = await self.cached("artist", id, "/getArtist", cache)
+        except SubsonicError as e:
+            self.warn(f'Failed to get the artist "{id}": {e}')
+            return None
+
+        return self.client.build_artist(artist_data, artist_data.get("album", []))
+
+    async def search3(
+        self,
+        query: str,
+        song_count: int = 20,
+        album_count: int = 20,
+        artist_count: int = 20,
+        cache: bool = True,
+    ) -> dict[str, list[dict[str, str]]]:
+        """Send a single /search3 request, see Subsonic.search3"""
+
+        counts = (song_count, album_count, artist_count)
+        if cache:
+            # The search cache and library mirror are SQLite lookups
+            buckets = await asyncio.to_thread(self.client.local_search, query, counts)
+            if buckets is not None:
+                return buckets
+
+        try:
+            search_results: dict = await self.data_request(
+                "/search3",
+                {
+                    **self.params,
+                    "query": query,
+                    "songCount": song_count,
+                    "albumCount": album_count,
+                    "artistCount": artist_count,
+                },
+                "searchResult3",
+            )
+        except SubsonicError as e:
+            # Only a definitive not found is an empty result, other errors are not cached
+            if e.code != NOT_FOUND:
+                raise
+            search_results = {}
+
+        return await asyncio.to_thread(
+            self.client.store_search, query, counts, search_results
+        )
+
+    async def search_all(
+        self,
+        query: str,
+        song_count: int = 20,
+        album_count: int = 20,
+        artist_count: int = 20,
+    ) -> SearchResult:
+        """Search songs, albums and artists with a single request and returns a SearchResult
+        model. Artists only contain the albums that were matched by the same search"""
+
+        self.info(f'Searching everything with the query "{query}"')
+
+        buckets = await self.search3(query, song_count, album_count, artist_count)
+
+        return self.client.build_search_result(buckets)
+
+    async def search_song(self, query: str, single: bool = True) -> list[Song] | None:
+        """Search a song with a query and generates a list of Song models, only the first
+        result if single, or None if no one is found"""
+
+        self.info(f'Searching a song with the query "{query}"')
+
+        results = (await self.search3(query, album_count=0, artist_count=0))["song"]
+        if not results:
+            self.warn("No song has been matched")
+            return None
+
+        songs = [
+            self.client.build_song(song) for song in results[: 1 if single else None]
+        ]
+        self.info(f"Matched {len(songs)} songs")
+        return songs
+
+    async def search_album(
+        self, query: str, single: bool = True
+    ) -> list[Album] | Album | None:
+        """Search an album with a query and returns the first Album model if single, the
+        matched albums with their songs otherwise, or None if no album is found"""
+
+        self.info(f'Searching an album with the query "{query}"')
+
+        results = (await self.search3(query, song_count=0, artist_count=0))["album"]
+        if not results:
+            self.warn("No album has been matched")
+            return None
+
+        if single:
+            album: Album = self.client.build_album(results[0])
+            self.info(f'Matched the album "{album.title}"')
+            return album
+
+        return await self.hydrate(self.get_album, [album["id"] for album in results])
+
+    async def search_artist(self, query: str) -> list[Artist] | None:
+        """Search an artist with a query and returns a list of Artist models or None if no
+        artist is found"""
+
+        self.info(f'Searching an artist with the query "{query}"')
+
+        results = (await self.search3(query, song_count=0, album_count=0))["artist"]
+        if not results:
+            self.warn("No artist has been matched")
+            return None
+
+        return await self.hydrate(self.get_artist, [artist["id"] for artist in results])
+
+    async def get_playlist(self, id: str) -> list[Song]:
+        """Generates a list of Song models with all the songs in a playlist by its ID"""
+
+        playlist: dict = await self.data_request(
+            "/getPlaylist", {**self.params, "id": id}, "playlist"
+        )
+
+        return [self.client.build_song(entry) for entry in playlist.get("entry", [])]
+
+    async def search_playlist(self, query: str) -> list[Song] | None:
+        """Search a playlist with a query and returns a list of Song models with all the songs
+        in the playlist or None if no playlist is found"""
+
+        self.info(f'Searching a playlist with the query "{query}"')
+
+        # The playlist index is loaded by a blocking request the first time
+        matched_playlist: dict | None = await asyncio.to_thread(
+            self.client.playlists.find, query
+        )
+        if matched_playlist is None:
+            self.warn("No playlist has been matched")
+            return None
+
+        self.info(f'Matched the playlist "{matched_playlist["name"]}"')
+
+        return await self.get_playlist(matched_playlist["id"])
+
+    async def get_now_playing(self) -> Song | None:
+        """Get the song that is currently playing on the server"""
+
+        now_playing: dict = await self.data_request(
+            "/getNowPlaying", self.params, "nowPlaying"
+        )
+        if not now_playing.get("entry"):
+            self.warn("No song currently playing")
+            return None
+
+        return self.client.build_song(now_playing["entry"][0])
+
+    async def scrobble(
+        self, id: str, submission: bool, played_at: float | None = None
+    ) -> bool:
+        """Scrobble a song by its ID, returns False if the server rejected it"""
+
+        self.info(f'Scrobbling song with ID "{id}"')
+
+        params = {**self.params, "id": id, "submission": submission}
+        if submission:
+            params["time"] = int((played_at or time.time()) * 1000)
+        try:
+            await self.data_request("/scrobble", params)
+        except SubsonicError:
+            return False
+        return True
+
+    def stats(self) -> dict[str, int]:
+        return {"requests": self.requests}
@@ -0,0 +1,352 @@
+import glob
+import hashlib
+import os
+import tempfile
+import time
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+import requests
+
+from .concurrency import FileLock
+
+if TYPE_CHECKING:
+    from .subsonic import Subsonic
+
+SUFFIX = ".audio"
+# Size of the chunks read from the server
+CHUNK_SIZE = 64 * 1024
+# Seconds without a write after which a partial download was abandoned by its process
+STALE_PART_AGE = 600
+
+
+class AudioCache:
+    """
+    Size capped directory of downloaded tracks with least recently used eviction.
+
+    The first stream of a song is written to the cache as it is read, so the track is only
+    downloaded once, and later plays are served from the local file. Files are named after a
+    hash of the song ID and the content type the server sent, which may differ from the type
+    of the original file, so the cache is rebuilt from the directory after a restart.
+
+    Several processes can share the directory. The modification time of a file tracks its
+    last use in any of them, and a new file is stored under a lock file that also rebuilds
+    the index from the directory before evicting, so the size cap holds across processes.
+    """
+
+    def __init__(
+        self,
+        client: "Subsonic",
+        directory: str,
+        max_bytes: int = 2 * 1024**3,
+        workers: int = 2,
+    ) -> None:
+        self.client: "Subsonic" = client
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+
+        self._lock: Lock = Lock()
+        self._directory_lock: FileLock = FileLock(os.path.join(directory, ".lock"))
+        # Key to file name and size
+        self._files: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self._pending: set[str] = set()
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="audio-cache"
+        )
+
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.bytes_served: int = 0
+        self.evictions: int = 0
+
+        os.makedirs(directory, exist_ok=True)
+        with self._directory_lock, self._lock:
+            self._load()
+
+    def _load(self) -> None:
+        """Index the files in the directory, oldest access first, the lock must be held"""
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted by another process meanwhile
+                continue
+            if entry.name.endswith(SUFFIX):
+                key = entry.name.partition(".")[0]
+                entries.append((stat.st_mtime, key, entry.name, stat.st_size))
+            elif (
+                entry.name.endswith(".part")
+                and time.time() - stat.st_mtime > STALE_PART_AGE
+            ):
+                # Interrupted download
+                os.remove(entry.path)
+
+        self._files.clear()
+        self.size = 0
+        for _, key, name, size in sorted(entries):
+            previous = self._files.pop(key, None)
+            if previous is not None:
+                # The track was stored again with another content type
+                self.size -= previous[1]
+                self._remove(previous[0])
+            self._files[key] = (name, size)
+            self.size += size
+        self._evict()
+
+    @staticmethod
+    def key(id: str) -> str:
+        return hashlib.sha1(id.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def content_type(path: str) -> str | None:
+        """Content type a cached track was sent with, None if it is not known"""
+
+        encoded = os.path.basename(path)[: -len(SUFFIX)].partition(".")[2]
+        return urllib.parse.unquote(encoded) or None
+
+    def lookup(self, id: str) -> str | None:
+        """Returns the path of the cached track and marks it as recently used, or None"""
+
+        key = self.key(id)
+        with self._lock:
+            entry = self._files.get(key)
+        if entry is None:
+            entry = self._adopt(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if key in self._files:
+                self._files.move_to_end(key)
+            self.hits += 1
+
+        path = os.path.join(self.directory, entry[0])
+        try:
+            # The modification time orders the files by use when the cache is reloaded
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                if self._files.pop(key, None) is not None:
+                    self.size -= entry[1]
+            return None
+        return path
+
+    def _adopt(self, key: str) -> tuple[str, int] | None:
+        """Index a track another process stored since the directory was last read"""
+
+        for path in glob.glob(os.path.join(self.directory, f"{key}.*{SUFFIX}")):
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                if key not in self._files:
+                    self._files[key] = (os.path.basename(path), size)
+                    self.size += size
+                return self._files[key]
+        return None
+
+    def served(self, size: int) -> None:
+        """Count bytes sent to a client from a cached track"""
+
+        with self._lock:
+            self.bytes_served += size
+
+    def _claim(self, key: str) -> bool:
+        """Reserve the download of a track, False if it is cached or already downloading"""
+
+        with self._lock:
+            if key in self._files or key in self._pending:
+                return False
+            self._pending.add(key)
+            return True
+
+    def prefetch(self, id: str) -> None:
+        """Download a track in the background unless it is cached or already downloading"""
+
+        key = self.key(id)
+        if self._claim(key):
+            self._executor.submit(self._download, id, key)
+
+    def tee(
+        self, id: str, chunks: Iterable[bytes], content_type: str | None
+    ) -> Iterator[bytes]:
+        """Yield the chunks of a full, untranscoded stream of a track while writing them to
+        the cache. The track is only stored if every chunk was read"""
+
+        key = self.key(id)
+        if not self._claim(key):
+            yield from chunks
+            return
+        yield from self._fill(key, chunks, content_type)
+
+    def _download(self, id: str, key: str) -> None:
+        try:
+            with open_stream(self.client, id) as r:
+                chunks = r.iter_content(chunk_size=CHUNK_SIZE)
+                for _ in self._fill(key, chunks, r.headers.get("Content-Type")):
+                    pass
+        except Exception as e:  # noqa
+            # We use a broad exception as a failed download only costs a future cache hit
+            self.client.warn(f'Failed to cache the track "{id}": {e}')
+
+    def _fill(
+        self, key: str, chunks: Iterable[bytes], content_type: str | None
+    ) -> Iterator[bytes]:
+        """Write the chunks to the cache as they are yielded, the key must be claimed"""
+
+        name = f"{key}.{urllib.parse.quote(content_type or '', safe='')}{SUFFIX}"
+        part = None
+        try:
+            descriptor, part = tempfile.mkstemp(suffix=".part", dir=self.directory)
+            with os.fdopen(descriptor, "wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    yield chunk
+            with self._directory_lock, self._lock:
+                os.replace(part, os.path.join(self.directory, name))
+                part = None
+                # Other processes may have stored or evicted tracks since the last store
+                self._load()
+        finally:
+            # A stream that was stopped or failed leaves an incomplete file behind
+            if part is not None:
+                os.remove(part)
+            with self._lock:
+                self._pending.discard(key)
+
+    def _evict(self) -> None:
+        """Drop the least recently used tracks until the cache fits, the lock must be held"""
+
+        while self.size > self.max_bytes and self._files:
+            _, (name, size) = self._files.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            self._remove(name)
+
+    def _remove(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            # Already evicted by another process
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._files),
+                "size": self.size,
+                "maxSize": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0,
+                "bytesServed": self.bytes_served,
+                "evictions": self.evictions,
+                "downloading": len(self._pending),
+            }
+
+
+def open_stream(client: "Subsonic", id: str, offset: int = 0) -> requests.Response:
+    """Open the original stream of a track from a byte offset, raises if the server did not
+    return audio"""
+
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    r: requests.Response = client.request(
+        "/stream", {**client.params, "id": id}, stream=True, headers=headers
+    )
+    if r.status_code != (206 if offset else 200) or not client.is_media(r):
+        r.close()
+        raise ValueError(
+            f"Unexpected response {r.status_code} {r.headers.get('Content-Type')}"
+        )
+    return r
+
+
+class TrackReader:
+    """
+    File-like reader of the original stream of a track, for players that read the track
+    themselves. The stream is opened on the first read and written to the audio cache as it
+    is read, if a cache is given.
+
+    Seeking reopens the stream from the new offset with a range request. Only a stream read
+    from its start is written to the cache, a seek drops the partial download.
+    """
+
+    def __init__(self, client: "Subsonic", id: str, cache: AudioCache | None) -> None:
+        self.client: "Subsonic" = client
+        self.id: str = id
+        self.cache: AudioCache | None = cache
+
+        self._lock: Lock = Lock()
+        self._response: requests.Response | None = None
+        self._chunks: Iterator[bytes] | None = None
+        self._buffer: bytes = b""
+        self._position: int = 0
+        self._aborted: bool = False
+
+    def read(self, size: int) -> bytes:
+        """Read up to size bytes, blocking until they arrive. Returns b"" at the end"""
+
+        if self._aborted:
+            raise ValueError("The stream was aborted")
+        if self._chunks is None:
+            response = open_stream(self.client, self.id, self._position)
+            with self._lock:
+                if self._aborted:
+                    response.close()
+                    raise ValueError("The stream was aborted")
+                self._response = response
+            chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+            if self.cache is not None and self._position == 0:
+                chunks = self.cache.tee(
+                    self.id, chunks, response.headers.get("Content-Type")
+                )
+            self._chunks = chunks
+
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b""
+            self._buffer = chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self._position += len(data)
+        return data
+
+    def seek(self, offset: int) -> None:
+        """Move to a byte offset, the stream is reopened from there on the next read"""
+
+        if offset == self._position:
+            return
+        self.close()
+        with self._lock:
+            self._response = None
+        self._chunks = None
+        self._buffer = b""
+        self._position = offset
+
+    def abort(self) -> None:
+        """Make a read blocked on the network fail, can be called from any thread"""
+
+        with self._lock:
+            self._aborted = True
+            if self._response is not None:
+                self._response.close()
+
+    def close(self) -> None:
+        """Release the stream, must not be called while a read is running"""
+
+        if self._chunks is not None and hasattr(self._chunks, "close"):
+            # An unfinished track is dropped from the cache
+            self._chunks.close()
+        with self._lock:
+            if self._response is not None:
+                self._response.close()
@@ -1,15 +1,117 @@
 import hashlib
 import secrets
-from dataclasses import dataclass
+import urllib.parse
+from collections import deque
+from threading import Condition, Thread
 
-from .config import SUBSONIC_CONFIG as CONFIG
 
-
-@dataclass(frozen=True)
 class Auth:
-    """Holds the token and salt used for Subsonic API authentication"""
+    """
+    Holds the credentials used for Subsonic API authentication.
+
+    Every request carries the username, a random salt and the MD5 hash of the password and
+    that salt as the token. The credentials are kept both as parameters and as a query string
+    encoded once, which URLs are built from.
+
+    By default one salt is generated per client. With a pool size, a fresh salt is used for
+    every request and URL. The pairs are hashed and encoded ahead of time by a background
+    thread that refills the pool, so taking one costs no hashing.
+    """
+
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        version: str = "1.16.1",
+        client: str = "Rhea",
+        pool_size: int = 0,
+    ) -> None:
+        self.username: str = username
+        self.password: str = password
+        self.version: str = version
+        self.client: str = client
+        self.pool_size: int = pool_size
+
+        self._changed: Condition = Condition()
+        # (parameters, encoded query string) of unused credentials
+        self._pool: deque[tuple[dict[str, str], str]] = deque()
+        self._thread: Thread | None = None
+
+        self.issued: int = 0
+        # Credentials hashed on the hot path because the pool had run dry
+        self.inline: int = 0
+
+        self._fixed: tuple[dict[str, str], str] = self._generate()
+        if self.pool_size:
+            self._pool.extend(self._generate() for _ in range(self.pool_size))
+
+    @property
+    def rotating(self) -> bool:
+        return self.pool_size > 0
+
+    def _generate(self) -> tuple[dict[str, str], str]:
+        salt = secrets.token_hex(16)
+        token = hashlib.md5(
+            self.password.encode("utf-8") + salt.encode("utf-8")
+        ).hexdigest()
+        params = {
+            "u": self.username,
+            "t": token,
+            "s": salt,
+            "v": self.version,
+            # Client name
+            "c": self.client,
+        }
+        return params, urllib.parse.urlencode(params)
+
+    def _take(self) -> tuple[dict[str, str], str]:
+        if not self.rotating:
+            return self._fixed
+
+        with self._changed:
+            self.issued += 1
+            if self._pool:
+                credentials = self._pool.popleft()
+                if len(self._pool) <= self.pool_size // 2:
+                    self._changed.notify()
+                return credentials
+            self.inline += 1
+            self._changed.notify()
+        return self._generate()
+
+    def params(self) -> dict[str, str]:
+        """Authentication parameters for a request, the caller must not modify them"""
+
+        return self._take()[0]
+
+    def query(self) -> str:
+        """Authentication parameters for a request as an encoded query string"""
+
+        return self._take()[1]
+
+    def start(self) -> None:
+        """Start refilling the pool in the background, nothing to do without rotation"""
+
+        if not self.rotating or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = Thread(target=self._run, name="subsonic-auth", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: len(self._pool) <= self.pool_size // 2)
+                missing = self.pool_size - len(self._pool)
+            # Hash outside of the lock so requests can keep taking credentials
+            fresh = [self._generate() for _ in range(missing)]
+            with self._changed:
+                self._pool.extend(fresh)
 
-    salt: str = secrets.token_hex(16)
-    token: str = hashlib.md5(
-        CONFIG["user"]["password"].encode("utf-8") + salt.encode("utf-8")
-    ).hexdigest()
+    def stats(self) -> dict:
+        with self._changed:
+            return {
+                "rotating": self.rotating,
+                "pooled": len(self._pool),
+                "issued": self.issued,
+                "inline": self.inline,
+            }
@@ -0,0 +1,284 @@
+import json
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable
+
+# Sentinel returned on a cache miss, as None is a valid cached value
+MISSING = object()
+
+
+class TTLCache:
+    """In-process LRU cache where every entry expires after a time to live"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600) -> None:
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock: Lock = Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, key: str) -> Any:
+        """Returns the cached value or MISSING"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "maxSize": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class DiskCache:
+    """
+    SQLite backed cache tier that survives restarts.
+
+    Values must be JSON serializable. The least recently used entries are evicted once the
+    cache holds more than max_size entries.
+    """
+
+    def __init__(self, path: str, max_size: int = 20000, ttl: float = 86400) -> None:
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+
+        self._lock: Lock = Lock()
+        self._db: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)"
+        )
+        self._db.commit()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, key: str) -> Any:
+        """Returns the cached value or MISSING"""
+
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return MISSING
+            self._db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires, now),
+            )
+            (size,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+            if size > self.max_size:
+                evicted = self._db.execute(
+                    "DELETE FROM cache WHERE key IN "
+                    "(SELECT key FROM cache ORDER BY accessed LIMIT ?)",
+                    (size - self.max_size,),
+                ).rowcount
+                self.evictions += evicted
+            self._db.commit()
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._db.commit()
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM cache WHERE key LIKE ? ESCAPE '\\'", (f"{escaped}%",)
+            )
+            self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM cache")
+            self._db.commit()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            (size,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+        return {
+            "size": size,
+            "maxSize": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class TieredCache:
+    """Memory cache in front of an optional disk cache"""
+
+    def __init__(self, memory: TTLCache, disk: DiskCache | None = None) -> None:
+        self.memory: TTLCache = memory
+        self.disk: DiskCache | None = disk
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is MISSING and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not MISSING:
+                # Promote to the memory tier so the next lookup does not touch the disk
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+    def get_or_fetch(
+        self, key: str, fetch: Callable[[], Any], bypass: bool = False
+    ) -> Any:
+        """Returns the cached value, or fetches and caches it. With bypass the cache is not
+        read but is still refreshed with the fetched value"""
+
+        if not bypass:
+            value = self.get(key)
+            if value is not MISSING:
+                return value
+
+        value = fetch()
+        self.set(key, value)
+        return value
+
+    def invalidate(self, key: str) -> None:
+        self.memory.invalidate(key)
+        if self.disk is not None:
+            self.disk.invalidate(key)
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        self.memory.invalidate_prefix(prefix)
+        if self.disk is not None:
+            self.disk.invalidate_prefix(prefix)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        stats = {"memory": self.memory.stats()}
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query so that "Play  The Weeknd!" and "play the weeknd" share a
+    cache entry. Case, punctuation and repeated whitespace are ignored"""
+
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = "".join(
+        " " if unicodedata.category(char).startswith("P") else char for char in query
+    )
+    return " ".join(query.split())
+
+
+class SearchCache:
+    """
+    Cache of search results keyed by the normalized query and the requested result counts.
+
+    Searches that the server answered with no matches are cached as well, with a shorter
+    time to live, so that repeated failed queries are answered without a round-trip. Errors
+    must never be stored, only successful answers.
+    """
+
+    def __init__(
+        self, max_size: int = 512, ttl: float = 300, negative_ttl: float = 60
+    ) -> None:
+        self.store: TTLCache = TTLCache(max_size=max_size, ttl=ttl)
+        self.negative_ttl: float = negative_ttl
+        self.negative_hits: int = 0
+        self._lock: Lock = Lock()
+
+    @staticmethod
+    def key(query: str, counts: tuple[int, ...]) -> str:
+        return f"{normalize_query(query)}|{','.join(str(count) for count in counts)}"
+
+    def get(self, query: str, counts: tuple[int, ...]) -> Any:
+        """Returns the cached result or MISSING"""
+
+        value = self.store.get(self.key(query, counts))
+        if value is not MISSING and not any(value.values()):
+            with self._lock:
+                self.negative_hits += 1
+        return value
+
+    def set(self, query: str, counts: tuple[int, ...], value: dict[str, list]) -> None:
+        empty = not any(value.values())
+        self.store.set(
+            self.key(query, counts), value, self.negative_ttl if empty else None
+        )
+
+    def clear(self) -> None:
+        self.store.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            negative_hits = self.negative_hits
+        return {**self.store.stats(), "negativeHits": negative_hits}
@@ -0,0 +1,93 @@
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Callable, Iterable, TypeVar
+
+try:
+    # Only on Unix, elsewhere the server runs as a single process and a thread lock is enough
+    import fcntl
+except ImportError:
+    fcntl = None
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def fan_out(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    max_workers: int = 8,
+    deadline: float | None = None,
+) -> list[tuple[R | None, BaseException | None]]:
+    """
+    Call fn on every item concurrently with at most max_workers calls in flight.
+
+    Returns a (result, error) pair for each item in the order of the items. Calls that raised
+    or did not finish before the deadline (in seconds) have a None result and an error.
+    """
+
+    items = list(items)
+    if not items:
+        return []
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    try:
+        futures: list[Future] = [executor.submit(fn, item) for item in items]
+        wait(futures, timeout=deadline)
+    finally:
+        # Do not wait on stragglers past the deadline, their results are discarded
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    results: list[tuple[R | None, BaseException | None]] = []
+    for future in futures:
+        if not future.done() or future.cancelled():
+            results.append((None, TimeoutError("Deadline exceeded")))
+        elif future.exception() is not None:
+            results.append((None, future.exception()))
+        else:
+            results.append((future.result(), None))
+
+    return results
+
+
+class FileLock:
+    """
+    Lock shared by every process that opens the same lock file, for state kept on disk by
+    several API workers at once. It also excludes the threads of this process, which share
+    a single file descriptor.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self._lock: Lock = Lock()
+        self._file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._lock.acquire(blocking):
+            return False
+        if fcntl is None:
+            return True
+
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a")
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            fcntl.flock(self._file, flags)
+        except BlockingIOError:
+            self._lock.release()
+            return False
+        except BaseException:
+            self._lock.release()
+            raise
+        return True
+
+    def release(self) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
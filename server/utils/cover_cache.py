@@ -0,0 +1,296 @@
+import glob
+import hashlib
+import io
+import mimetypes
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import TYPE_CHECKING
+
+from .concurrency import FileLock
+
+try:
+    # Pillow is optional, without it resized covers are requested from the server
+    from PIL import Image
+except ImportError:
+    Image = None
+
+if TYPE_CHECKING:
+    from .subsonic import Subsonic
+
+# Name of the lock file, in the cache directory
+LOCK_NAME = ".lock"
+# Seconds without a write after which a partial file was abandoned by its process
+STALE_PART_AGE = 60
+
+
+class CoverCache:
+    """
+    Size capped directory of cover art with least recently used eviction.
+
+    The original image and every requested size are stored as separate files. Resized
+    variants are made locally from the cached original when Pillow is installed, otherwise
+    the server is asked for the size. Files are named after a hash of the cover ID and size,
+    with the image type as the extension, so the cache is rebuilt from the directory after a
+    restart. Covers the server reports as not found are remembered for missing_ttl seconds,
+    so albums without a cover are not requested again on every view.
+
+    API workers share the directory. Lookups touch the modification time of the files, and
+    every store rebuilds the index from the directory under a lock file before evicting, so
+    the least recently used covers of all the workers go first.
+    """
+
+    def __init__(
+        self,
+        client: "Subsonic",
+        directory: str,
+        max_bytes: int = 256 * 1024**2,
+        missing_ttl: float = 300,
+    ) -> None:
+        self.client: "Subsonic" = client
+        self.directory: str = os.path.abspath(directory)
+        self.max_bytes: int = max_bytes
+        self.missing_ttl: float = missing_ttl
+
+        self._lock: Lock = Lock()
+        self._directory_lock: FileLock = FileLock(
+            os.path.join(self.directory, LOCK_NAME)
+        )
+        # Key to file name and size
+        self._files: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        # One lock per key being fetched, so concurrent requests for a cover fetch it once
+        self._fetching: dict[str, Lock] = {}
+        # Key to the monotonic time until which the cover is known to be missing
+        self._missing: dict[str, float] = {}
+
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.missing_hits: int = 0
+        self.resized: int = 0
+        self.evictions: int = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._directory_lock, self._lock:
+            self._load()
+            self._evict()
+
+    def _load(self) -> None:
+        """Index the files in the directory, oldest access first, the locks must be held"""
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or entry.name == LOCK_NAME:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted by another worker meanwhile
+                continue
+            if entry.name.endswith(".part"):
+                if time.time() - stat.st_mtime > STALE_PART_AGE:
+                    # Interrupted write
+                    self._remove(entry.name)
+                continue
+            key = entry.name.partition(".")[0]
+            entries.append((stat.st_mtime, key, entry.name, stat.st_size))
+
+        self._files.clear()
+        self.size = 0
+        for _, key, name, size in sorted(entries):
+            previous = self._files.pop(key, None)
+            if previous is not None:
+                # The cover was stored again with another image type
+                self.size -= previous[1]
+                self._remove(previous[0])
+            self._files[key] = (name, size)
+            self.size += size
+
+    @staticmethod
+    def key(id: str, size: int | None = None) -> str:
+        return hashlib.sha1(f"{id}:{size or 0}".encode("utf-8")).hexdigest()
+
+    def lookup(self, id: str, size: int | None = None) -> str | None:
+        """Returns the path of a cached cover and marks it as recently used, or None"""
+
+        path = self._use(self.key(id, size))
+        with self._lock:
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return path
+
+    def _use(self, key: str) -> str | None:
+        """Path of a cached cover marked as recently used, without counting the lookup"""
+
+        with self._lock:
+            entry = self._files.get(key)
+        if entry is None:
+            entry = self._adopt(key)
+            if entry is None:
+                return None
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+
+        path = os.path.join(self.directory, entry[0])
+        try:
+            # The modification time orders the files by use when the cache is reloaded
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                if self._files.pop(key, None) is not None:
+                    self.size -= entry[1]
+            return None
+        return path
+
+    def _adopt(self, key: str) -> tuple[str, int] | None:
+        """Index a cover another worker stored since the directory was last read"""
+
+        for path in glob.glob(os.path.join(self.directory, f"{key}.*")):
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                if key not in self._files:
+                    self._files[key] = (os.path.basename(path), size)
+                    self.size += size
+                return self._files[key]
+        return None
+
+    def fetch(self, id: str, size: int | None = None) -> str | None:
+        """Returns the path of a cover after a lookup missed, fetching it unless it is known
+        to be missing. None if there is no cover"""
+
+        key = self.key(id, size)
+        with self._lock:
+            fetching = self._fetching.setdefault(key, Lock())
+        with fetching:
+            # Another request may have stored it while this one waited
+            path = self._use(key)
+            if path is None and not self._known_missing(key):
+                path = self._fetch(id, size, key)
+        with self._lock:
+            self._fetching.pop(key, None)
+        return path
+
+    def _known_missing(self, key: str) -> bool:
+        with self._lock:
+            expiry = self._missing.get(key)
+            if expiry is None:
+                return False
+            if expiry <= time.monotonic():
+                del self._missing[key]
+                return False
+            self.missing_hits += 1
+            return True
+
+    def _remember_missing(self, key: str) -> None:
+        with self._lock:
+            now = time.monotonic()
+            # Expired entries are dropped here so covers that are never asked again go away
+            for expired in [k for k, expiry in self._missing.items() if expiry <= now]:
+                del self._missing[expired]
+            self._missing[key] = now + self.missing_ttl
+
+    def _fetch(self, id: str, size: int | None, key: str) -> str | None:
+        if size is not None and Image is not None:
+            original = self._use(self.key(id)) or self.fetch(id)
+            if original is None:
+                return None
+            return self._resize(original, size, key)
+
+        params = {**self.client.params, "id": id}
+        if size is not None:
+            params["size"] = size
+        try:
+            r = self.client.request("/getCoverArt", params)
+            if r.status_code != 404:
+                r.raise_for_status()
+        except Exception as e:  # noqa
+            # We use a broad exception as there are a variety of Connection* errors that can be raised
+            self.client.warn(f'Failed to fetch the cover "{id}": {e}')
+            return None
+
+        content_type = r.headers.get("Content-Type", "").split(";")[0]
+        if not content_type.startswith("image/"):
+            # Subsonic reports errors as an XML or JSON body, only a definitive not found is
+            # remembered as transient errors may not happen again
+            if self.client.is_not_found(r):
+                self._remember_missing(key)
+            self.client.warn(f'No cover art found for "{id}"')
+            return None
+        return self._store(key, r.content, mimetypes.guess_extension(content_type))
+
+    def _resize(self, original: str, size: int, key: str) -> str | None:
+        try:
+            with Image.open(original) as image:
+                image_format = image.format
+                # Keeps the aspect ratio and never scales up
+                image.thumbnail((size, size))
+                if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                body = io.BytesIO()
+                image.save(body, format=image_format)
+        except (OSError, ValueError) as e:
+            self.client.warn(f"Failed to resize {original}: {e}")
+            return None
+
+        self.resized += 1
+        return self._store(key, body.getvalue(), os.path.splitext(original)[1])
+
+    def _store(self, key: str, body: bytes, extension: str | None) -> str:
+        name = f"{key}{extension or '.img'}"
+        path = os.path.join(self.directory, name)
+        descriptor, part = tempfile.mkstemp(suffix=".part", dir=self.directory)
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(body)
+
+        with self._directory_lock, self._lock:
+            os.replace(part, path)
+            # Other workers may have stored or evicted covers since the last store
+            self._load()
+            self._evict(keep=key)
+        return path
+
+    def _evict(self, keep: str | None = None) -> None:
+        """Drop the least recently used covers until the cache fits, the lock must be held"""
+
+        while self.size > self.max_bytes and len(self._files) > (keep is not None):
+            key = next(iter(self._files))
+            if key == keep:
+                # Never drop the file that is about to be served
+                self._files.move_to_end(key)
+                continue
+            name, size = self._files.pop(key)
+            self.size -= size
+            self.evictions += 1
+            self._remove(name)
+
+    def _remove(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            # Already removed by another worker
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._files),
+                "size": self.size,
+                "maxSize": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0,
+                "missing": len(self._missing),
+                "missingHits": self.missing_hits,
+                "resized": self.resized,
+                "evictions": self.evictions,
+                "resizing": Image is not None,
+            }
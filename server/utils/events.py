@@ -0,0 +1,129 @@
+from collections import deque
+from dataclasses import dataclass
+from itertools import count
+from threading import Condition, Lock
+
+
+@dataclass(frozen=True, slots=True)
+class Event:
+    id: int
+    type: str
+    data: dict
+
+
+class Subscription:
+    """
+    Events waiting for one subscriber, read with get.
+
+    The buffer is bounded, when a slow subscriber lets it fill up the oldest events are
+    dropped and the next get ends with the latest event of every type, so the subscriber
+    still ends up with the current state.
+    """
+
+    def __init__(self, bus: "EventBus", size: int) -> None:
+        self.bus: "EventBus" = bus
+        self.dropped: int = 0
+        self.closed: bool = False
+
+        self._events: deque[Event] = deque(maxlen=size)
+        self._available: Condition = Condition()
+        self._lagged: bool = False
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def push(self, event: Event) -> bool:
+        """Add an event without ever waiting for the subscriber, returns True if the oldest
+        event was dropped to make room"""
+
+        with self._available:
+            full = len(self._events) == self._events.maxlen
+            if full:
+                self.dropped += 1
+                self._lagged = True
+            self._events.append(event)
+            self._available.notify()
+        return full
+
+    def get(self, timeout: float | None = None) -> list[Event]:
+        """Wait up to timeout seconds for events, returns an empty list if none arrived"""
+
+        with self._available:
+            self._available.wait_for(lambda: self._events or self.closed, timeout)
+            events = list(self._events)
+            self._events.clear()
+            lagged, self._lagged = self._lagged, False
+        if lagged:
+            received = {event.id for event in events}
+            events.extend(e for e in self.bus.latest() if e.id not in received)
+        return events
+
+    def close(self) -> None:
+        self.bus.unsubscribe(self)
+        with self._available:
+            self.closed = True
+            self._available.notify_all()
+
+
+class EventBus:
+    """
+    Fans out player events to any number of subscribers.
+
+    Publishing only appends to the bounded buffer of each subscriber, so the player thread
+    never waits on a slow or stalled client. The latest event of every type is kept and
+    replayed to new subscribers, which start from the current state instead of polling it.
+    """
+
+    def __init__(self, buffer_size: int = 64) -> None:
+        self.buffer_size: int = buffer_size
+
+        self._lock: Lock = Lock()
+        self._subscribers: set[Subscription] = set()
+        self._latest: dict[str, Event] = {}
+        self._ids = count(1)
+
+        self.published: int = 0
+        # Kept by the bus so events dropped for subscribers that have left still count
+        self.dropped: int = 0
+
+    def publish(self, type: str, data: dict) -> None:
+        with self._lock:
+            event = Event(next(self._ids), type, data)
+            self._latest[type] = event
+            self.published += 1
+            subscribers = list(self._subscribers)
+        dropped = sum(subscription.push(event) for subscription in subscribers)
+        if dropped:
+            with self._lock:
+                self.dropped += dropped
+
+    def latest(self) -> list[Event]:
+        """The latest event of every type, oldest first"""
+
+        with self._lock:
+            return sorted(self._latest.values(), key=lambda event: event.id)
+
+    def subscribe(self) -> Subscription:
+        """A new subscription, starting with the latest event of every type"""
+
+        subscription = Subscription(self, self.buffer_size)
+        with self._lock:
+            for event in sorted(self._latest.values(), key=lambda event: event.id):
+                self.dropped += subscription.push(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "published": self.published,
+                "dropped": self.dropped,
+            }
@@ -0,0 +1,120 @@
+from array import array
+from collections import Counter
+from threading import Lock
+
+from .cache import normalize_query
+
+# Text indexed for each kind of item, so "blinding lights the weeknd" finds the song
+FIELDS: dict[str, tuple[str, ...]] = {
+    "song": ("title", "artist"),
+    "album": ("name", "artist"),
+    "artist": ("name",),
+}
+
+
+def trigrams(text: str) -> set[str]:
+    """Trigrams of every word of the normalized text, words are padded so that short words
+    and word boundaries still produce trigrams"""
+
+    grams: set[str] = set()
+    for word in normalize_query(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    Typo tolerant in-memory index over the titles of songs, albums and artists.
+
+    Items are added as the client sees them. Each item is stored once with only its ID and
+    indexed text, and the trigrams of that text point to it through compact integer posting
+    lists. Matches
+    are scored by averaging the share of query trigrams found in the item with the Dice
+    coefficient of both trigram sets, so full titles rank above items that merely contain
+    the query.
+    """
+
+    def __init__(self, max_size: int = 200000) -> None:
+        self.max_size: int = max_size
+
+        self._lock: Lock = Lock()
+        self._ids: dict[tuple[str, str], int] = {}
+        self._items: list[tuple[str, dict, int]] = []
+        self._postings: dict[str, array] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, kind: str, attrib: dict) -> None:
+        """Index an item by the raw attributes returned by the server"""
+
+        key = (kind, attrib.get("id"))
+        if key[1] is None or kind not in FIELDS:
+            return
+        # Full payloads, such as albums with their songs, would stay alive in the index
+        attrib = {"id": key[1], **{field: attrib.get(field) for field in FIELDS[kind]}}
+
+        with self._lock:
+            doc = self._ids.get(key)
+            if doc is not None:
+                # Titles do not change, only the attributes are refreshed
+                self._items[doc] = (kind, attrib, self._items[doc][2])
+                return
+            if len(self._items) >= self.max_size:
+                return
+
+            grams = trigrams(
+                " ".join(attrib.get(field) or "" for field in FIELDS[kind])
+            )
+            if not grams:
+                return
+            doc = len(self._items)
+            self._ids[key] = doc
+            self._items.append((kind, attrib, len(grams)))
+            for gram in grams:
+                self._postings.setdefault(gram, array("I")).append(doc)
+
+    def add_all(self, buckets: dict[str, list[dict]]) -> None:
+        """Index the buckets returned by Subsonic.search3"""
+
+        for kind, items in buckets.items():
+            for attrib in items:
+                self.add(kind, attrib)
+
+    def search(
+        self, query: str, kind: str, limit: int = 1, threshold: float = 0.6
+    ) -> list[tuple[float, dict]]:
+        """Returns up to limit (score, attributes) pairs of the given kind, best first, whose
+        score is at least the threshold. Scores range from 0 to 1 and the attributes are the
+        ID and the indexed fields"""
+
+        grams = trigrams(query)
+        if not grams:
+            return []
+
+        shared: Counter[int] = Counter()
+        with self._lock:
+            for gram in grams:
+                posting = self._postings.get(gram)
+                if posting is not None:
+                    shared.update(posting)
+
+            matches: list[tuple[float, dict]] = []
+            for doc, count in shared.items():
+                doc_kind, attrib, size = self._items[doc]
+                if doc_kind != kind:
+                    continue
+                score = (count / len(grams) + 2 * count / (len(grams) + size)) / 2
+                if score >= threshold:
+                    matches.append((score, attrib))
+
+        matches.sort(key=lambda match: match[0], reverse=True)
+        return matches[:limit]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "items": len(self._items),
+            "maxSize": self.max_size,
+            "trigrams": len(self._postings),
+        }
@@ -0,0 +1,82 @@
+import time
+from threading import Event, Lock, Thread
+from typing import Callable
+
+
+class HealthMonitor:
+    """
+    Keeps a cached up/down state of the Subsonic server.
+
+    The state is refreshed by a background prober every interval seconds and passively by
+    reporting the outcome of real requests. A failed request does not mark the server down by
+    itself, as a single timeout says little about the whole API, it makes the prober check the
+    server right away instead. The server is assumed to be up until proven otherwise so that
+    requests are not refused while the first probe is running.
+    """
+
+    def __init__(self, probe: Callable[[], bool], interval: float = 30) -> None:
+        self.probe: Callable[[], bool] = probe
+        self.interval: float = interval
+
+        self.up: bool = True
+        self.last_checked: float | None = None
+        self.last_error: str | None = None
+
+        self._lock: Lock = Lock()
+        self._stop: Event = Event()
+        self._wake: Event = Event()
+        self._thread: Thread | None = None
+
+    def start(self) -> None:
+        """Start the background prober if it is not already running"""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="subsonic-health", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def check(self) -> bool:
+        """Probe the server now and update the cached state"""
+
+        try:
+            up = self.probe()
+            error = None if up else "Ping returned a failed status"
+        except Exception as e:  # noqa
+            # We use a broad exception as there are a variety of Connection* errors that can be raised
+            up = False
+            error = str(e)
+        self._set(up, error)
+        return up
+
+    def report_success(self) -> None:
+        self._set(True, None)
+
+    def report_failure(self, error: str) -> None:
+        with self._lock:
+            self.last_error = error
+        self._wake.set()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "up": self.up,
+                "lastChecked": self.last_checked,
+                "lastError": self.last_error,
+            }
+
+    def _set(self, up: bool, error: str | None) -> None:
+        with self._lock:
+            self.up = up
+            self.last_checked = time.time()
+            self.last_error = error
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.check()
+            self._wake.wait(self.interval)
+            self._wake.clear()
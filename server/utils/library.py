@@ -0,0 +1,284 @@
+import json
+import sqlite3
+import time
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING
+
+from .cache import normalize_query
+from .concurrency import FileLock, fan_out
+
+if TYPE_CHECKING:
+    from .subsonic import Subsonic
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artists (rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, data TEXT);
+CREATE TABLE IF NOT EXISTS albums (
+    rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, signature TEXT, data TEXT
+);
+CREATE TABLE IF NOT EXISTS songs (rowid INTEGER PRIMARY KEY, id TEXT, album_id TEXT, data TEXT);
+CREATE INDEX IF NOT EXISTS songs_album ON songs (album_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS artists_fts USING fts5(name, tokenize='unicode61');
+CREATE VIRTUAL TABLE IF NOT EXISTS albums_fts USING fts5(name, artist, tokenize='unicode61');
+CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(
+    title, artist, album, tokenize='unicode61'
+);
+"""
+
+
+class Library:
+    """
+    Local mirror of the Subsonic library with full text search.
+
+    The mirror is kept in a SQLite database with FTS5 indexes, so searches are answered
+    locally without a round-trip. A sync lists every album with getAlbumList2 and only
+    fetches the albums that are new or have changed since the last sync.
+
+    API workers share the database. The first one to take the lock file next to it owns the
+    syncs until it exits, the others only search the mirror.
+    """
+
+    def __init__(
+        self,
+        client: "Subsonic",
+        path: str,
+        refresh_interval: float = 3600,
+        page_size: int = 500,
+    ) -> None:
+        self.client: "Subsonic" = client
+        self.refresh_interval: float = refresh_interval
+        self.page_size: int = page_size
+
+        self._lock: Lock = Lock()
+        self._db: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+        # Searches of other workers are not blocked while a sync writes
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        self._sync_lock: FileLock = FileLock(f"{path}.lock")
+        self.owner: bool = False
+
+        self._stop: Event = Event()
+        self._thread: Thread | None = None
+
+        self._ready: bool = False
+        self.last_synced: float | None = None
+
+    def start(self) -> None:
+        """Start syncing the library in the background every refresh interval"""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="subsonic-library", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def ready(self) -> bool:
+        """The mirror can be searched as soon as it holds a sync, from any worker"""
+
+        if not self._ready:
+            with self._lock:
+                self._ready = (
+                    self._db.execute("SELECT 1 FROM albums LIMIT 1").fetchone()
+                    is not None
+                )
+        return self._ready
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            # The lock is never released, another worker takes over if the owner exits
+            if not self.owner:
+                self.owner = self._sync_lock.acquire(blocking=False)
+            if self.owner:
+                try:
+                    self.sync()
+                except Exception as e:  # noqa
+                    # A failed sync keeps the previous mirror, it is retried on the next interval
+                    self.client.warn(f"Failed to sync the library: {e}")
+            self._stop.wait(self.refresh_interval)
+
+    def list_albums(self) -> list[dict]:
+        """List every album on the server, page by page"""
+
+        return list(self.client.iter_albums(page_size=self.page_size))
+
+    def list_artists(self) -> list[dict]:
+        indexes: dict = self.client.data_request(
+            "/getArtists", self.client.params, "artists"
+        )
+        return [
+            artist
+            for index in indexes.get("index", [])
+            for artist in index.get("artist", [])
+        ]
+
+    @staticmethod
+    def signature(album: dict) -> str:
+        """Value that changes whenever the album is modified on the server"""
+
+        return "|".join(
+            str(album.get(key, ""))
+            for key in ("changed", "created", "songCount", "duration")
+        )
+
+    def sync(self) -> None:
+        """Bring the mirror up to date with the server"""
+
+        started = time.monotonic()
+        self.client.info("Syncing the library")
+
+        artists = self.list_artists()
+        albums = self.list_albums()
+        for artist in artists:
+            self.client.fuzzy.add("artist", artist)
+
+        with self._lock:
+            known: dict[str, str] = dict(
+                self._db.execute("SELECT id, signature FROM albums").fetchall()
+            )
+        signatures: dict[str, str] = {
+            album["id"]: self.signature(album) for album in albums if album.get("id")
+        }
+        changed = [
+            id for id, signature in signatures.items() if known.get(id) != signature
+        ]
+        removed = known.keys() - signatures.keys()
+
+        results = fan_out(
+            lambda id: self.client.cached("album", id, "/getAlbum", cache=False),
+            changed,
+            max_workers=self.client.hydration_concurrency,
+        )
+
+        with self._lock:
+            try:
+                self._replace_artists(artists)
+                for id in removed:
+                    self._delete_album(id)
+                for id, (album, exception) in zip(changed, results):
+                    if exception is not None:
+                        # The old signature is kept so the album is fetched again next sync
+                        self.client.warn(f'Failed to sync album "{id}": {exception}')
+                        continue
+                    self._delete_album(id)
+                    self._insert_album(id, album, signatures[id])
+                self._db.commit()
+            except Exception:  # noqa
+                # The previous mirror is kept whole rather than left half updated
+                self._db.rollback()
+                raise
+
+        self._ready = True
+        self.last_synced = time.time()
+        self.client.info(
+            f"Synced {len(albums)} albums, {len(changed)} changed and {len(removed)} removed, "
+            f"in {time.monotonic() - started:.1f}s"
+        )
+
+    def _replace_artists(self, artists: list[dict]) -> None:
+        self._db.execute("DELETE FROM artists")
+        self._db.execute("DELETE FROM artists_fts")
+        for artist in artists:
+            rowid = self._db.execute(
+                "INSERT INTO artists (id, data) VALUES (?, ?)",
+                (artist.get("id"), json.dumps(artist)),
+            ).lastrowid
+            self._db.execute(
+                "INSERT INTO artists_fts (rowid, name) VALUES (?, ?)",
+                (rowid, artist.get("name", "")),
+            )
+
+    def _delete_album(self, id: str) -> None:
+        row = self._db.execute(
+            "SELECT rowid FROM albums WHERE id = ?", (id,)
+        ).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM albums_fts WHERE rowid = ?", row)
+            self._db.execute("DELETE FROM albums WHERE rowid = ?", row)
+        self._db.execute(
+            "DELETE FROM songs_fts WHERE rowid IN (SELECT rowid FROM songs WHERE album_id = ?)",
+            (id,),
+        )
+        self._db.execute("DELETE FROM songs WHERE album_id = ?", (id,))
+
+    def _insert_album(self, id: str, album: dict, signature: str) -> None:
+        # Attributes other than the ID are optional, they are read with defaults
+        songs = album.get("song", [])
+        data = {key: value for key, value in album.items() if key != "song"}
+        rowid = self._db.execute(
+            "INSERT INTO albums (id, signature, data) VALUES (?, ?, ?)",
+            (id, signature, json.dumps(data)),
+        ).lastrowid
+        self._db.execute(
+            "INSERT INTO albums_fts (rowid, name, artist) VALUES (?, ?, ?)",
+            (rowid, album.get("name", ""), album.get("artist", "")),
+        )
+        for song in songs:
+            rowid = self._db.execute(
+                "INSERT INTO songs (id, album_id, data) VALUES (?, ?, ?)",
+                (song.get("id"), id, json.dumps(song)),
+            ).lastrowid
+            self._db.execute(
+                "INSERT INTO songs_fts (rowid, title, artist, album) VALUES (?, ?, ?, ?)",
+                (
+                    rowid,
+                    song.get("title", ""),
+                    song.get("artist", ""),
+                    song.get("album", ""),
+                ),
+            )
+
+    @staticmethod
+    def match_expression(query: str) -> str | None:
+        """Turn a query into an FTS5 expression matching every word as a prefix"""
+
+        words = normalize_query(query).split()
+        if not words:
+            return None
+        return " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+    def _match(self, table: str, expression: str, limit: int) -> list[dict]:
+        if limit <= 0:
+            return []
+        rows = self._db.execute(
+            f"SELECT {table}.data FROM {table}_fts JOIN {table} ON {table}.rowid = {table}_fts.rowid "
+            f"WHERE {table}_fts MATCH ? ORDER BY {table}_fts.rank LIMIT ?",
+            (expression, limit),
+        ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def search(
+        self,
+        query: str,
+        song_count: int = 20,
+        album_count: int = 20,
+        artist_count: int = 20,
+    ) -> dict[str, list[dict]]:
+        """Search the mirror, returns the same buckets as Subsonic.search3"""
+
+        expression = self.match_expression(query)
+        if expression is None:
+            return {"song": [], "album": [], "artist": []}
+
+        with self._lock:
+            return {
+                "song": self._match("songs", expression, song_count),
+                "album": self._match("albums", expression, album_count),
+                "artist": self._match("artists", expression, artist_count),
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {
+                table: self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("songs", "albums", "artists")
+            }
+        return {
+            **counts,
+            "ready": self.ready,
+            "owner": self.owner,
+            "lastSynced": self.last_synced,
+        }
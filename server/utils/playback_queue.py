@@ -0,0 +1,165 @@
+import random
+from collections import deque
+from itertools import count, islice
+from threading import Condition
+from typing import Callable, Generic, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+class PlaybackQueue(Generic[T]):
+    """
+    Thread safe queue of tracks waiting to be played.
+
+    Enqueueing at either end and dequeueing from the front are O(1). Indexed insert, remove
+    and move are supported for queue management. The player thread can block in pop or wait
+    until a request thread adds work.
+
+    Every entry gets a sequence number that never changes while it is queued, which clients
+    use as a stable cursor, and the version of the queue is bumped on every change.
+    """
+
+    def __init__(self, items: Iterable[T] = ()) -> None:
+        self._sequence = count()
+        self._items: deque[tuple[int, T]] = deque(
+            (next(self._sequence), item) for item in items
+        )
+        self._changed: Condition = Condition()
+        self.version: int = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+    def _bump(self) -> None:
+        """Record a change, the lock must be held"""
+
+        self.version += 1
+        self._changed.notify_all()
+
+    def append(self, item: T) -> None:
+        with self._changed:
+            self._items.append((next(self._sequence), item))
+            self._bump()
+
+    def appendleft(self, item: T) -> None:
+        """Queue an item to be played next"""
+
+        with self._changed:
+            self._items.appendleft((next(self._sequence), item))
+            self._bump()
+
+    def extend(self, items: Iterable[T]) -> None:
+        with self._changed:
+            self._items.extend((next(self._sequence), item) for item in items)
+            self._bump()
+
+    def insert(self, index: int, item: T) -> None:
+        with self._changed:
+            self._items.insert(index, (next(self._sequence), item))
+            self._bump()
+
+    def remove(self, index: int) -> T:
+        """Remove and return the item at index, raises IndexError if there is none"""
+
+        with self._changed:
+            _, item = self._items[index]
+            del self._items[index]
+            self._bump()
+            return item
+
+    def move(self, source: int, destination: int) -> None:
+        """Move the item at source so that it ends up at destination"""
+
+        with self._changed:
+            entry = self._items[source]
+            del self._items[source]
+            self._items.insert(destination, entry)
+            self._bump()
+
+    def pop(self, block: bool = False, timeout: float | None = None) -> T | None:
+        """
+        Remove and return the first item.
+
+        Returns None if the queue is empty, or when blocking, if no item arrived before the
+        timeout.
+        """
+
+        with self._changed:
+            if block and not self._items:
+                self._changed.wait_for(lambda: self._items, timeout)
+            if not self._items:
+                return None
+            _, item = self._items.popleft()
+            self._bump()
+            return item
+
+    def peek(self) -> T | None:
+        """Returns the first item without removing it or None if the queue is empty"""
+
+        with self._changed:
+            return self._items[0][1] if self._items else None
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until the queue is changed or the timeout expires. Returns False on timeout"""
+
+        with self._changed:
+            return self._changed.wait(timeout)
+
+    def wait_for(
+        self, predicate: Callable[[], bool], timeout: float | None = None
+    ) -> bool:
+        """Block until predicate, evaluated with the lock held, is true. Changes to the queue
+        and calls to notify wake the waiter up to evaluate it again"""
+
+        with self._changed:
+            return self._changed.wait_for(predicate, timeout)
+
+    def notify(self) -> None:
+        """Wake up waiters without changing the queue, for other events they wait on"""
+
+        with self._changed:
+            self._changed.notify_all()
+
+    def shuffle(self) -> None:
+        with self._changed:
+            entries = list(self._items)
+            random.shuffle(entries)
+            self._items = deque(entries)
+            self._bump()
+
+    def clear(self) -> None:
+        with self._changed:
+            self._items.clear()
+            self._bump()
+
+    def slice(self, start: int = 0, stop: int | None = None) -> list[T]:
+        """Returns a copy of the items from start to stop"""
+
+        with self._changed:
+            return [item for _, item in islice(self._items, start, stop)]
+
+    def page(
+        self, offset: int = 0, limit: int = 50, after: int | None = None
+    ) -> tuple[list[tuple[int, T]], int, int, int]:
+        """
+        Returns a consistent page of (sequence number, item) entries along with the position
+        of the first entry, the total length and the version of the queue.
+
+        With after, the page starts right after the entry with that sequence number, offset
+        is then relative to it. If that entry has left the queue, for example because it has
+        been played, the page starts from the front.
+        """
+
+        with self._changed:
+            start = 0
+            if after is not None:
+                for position, (sequence, _) in enumerate(self._items):
+                    if sequence == after:
+                        start = position + 1
+                        break
+            start += offset
+            entries = list(islice(self._items, start, start + limit))
+            return entries, start, len(self._items), self.version
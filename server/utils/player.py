@@ -0,0 +1,356 @@
+import ctypes
+import os
+from concurrent.futures import Future
+from itertools import count
+
+import vlc
+
+from .audio_cache import TrackReader
+from .events import EventBus
+from .logging import Logger
+from .playback_queue import PlaybackQueue
+from .player_commands import (
+    MAX_VOLUME,
+    MIN_VOLUME,
+    ChangeVolume,
+    Clear,
+    Command,
+    Enqueue,
+    Mailbox,
+    Shuffle,
+    Skip,
+    Stop,
+    TogglePause,
+)
+from .subsonic import Song, Subsonic
+
+# Readers of the tracks VLC reads through callbacks, by the handle given to VLC. The callbacks
+# are defined once so they outlive every media that uses them
+_readers: dict[int, TrackReader] = {}
+_handles = count(1)
+
+
+@vlc.CallbackDecorators.MediaReadCb
+def _read_track(opaque, buffer, length):
+    reader = _readers.get(opaque)
+    if reader is None:
+        return -1
+    try:
+        data = reader.read(length)
+    except Exception:  # noqa
+        # We use a broad exception as VLC only needs to know that the read failed
+        return -1
+    ctypes.memmove(buffer, data, len(data))
+    return len(data)
+
+
+@vlc.CallbackDecorators.MediaSeekCb
+def _seek_track(opaque, offset):
+    reader = _readers.get(opaque)
+    if reader is None:
+        return -1
+    reader.seek(offset)
+    return 0
+
+
+@vlc.CallbackDecorators.MediaCloseCb
+def _close_track(opaque):
+    reader = _readers.pop(opaque, None)
+    if reader is not None:
+        reader.close()
+
+
+class Player:
+    """
+    Plays the songs of a queue with VLC.
+
+    The playback thread sleeps until there is something to do. It is woken up by changes to
+    the queue and by VLC events for the end of a track, errors and time changes, so the next
+    track starts as soon as the current one ends and an idle player costs no CPU.
+
+    A second media player pre-buffers the next queued song, opened and paused at its start,
+    during the last seconds of the current one. When the current song ends or is skipped the
+    two media players swap and playback resumes without waiting on the network.
+
+    Tracks missing from the audio cache are read by VLC through callbacks, so the single
+    download of a track both plays it and fills the cache.
+
+    The playback thread is the only one that touches VLC or changes the queue. Other threads
+    submit commands to its mailbox and get a future for the result. VLC does not allow calling
+    into libvlc from its event callbacks either, the callbacks only record what happened and
+    wake the playback thread, which does the actual work.
+
+    The playback thread publishes track, pause, queue and volume events to the event bus
+    whenever it changes one of them.
+    """
+
+    def __init__(
+        self,
+        queue: PlaybackQueue[Song],
+        subsonic: Subsonic,
+        logger: Logger,
+        events: EventBus,
+        volume: int = 50,
+        prebuffer_seconds: float = 10,
+    ) -> None:
+        self.queue: PlaybackQueue[Song] = queue
+        self.subsonic: Subsonic = subsonic
+        self.logger: Logger = logger
+        self.events: EventBus = events
+        self.prebuffer_seconds: float = prebuffer_seconds
+
+        self.instance: vlc.Instance = vlc.Instance()
+        self.media_player: vlc.MediaPlayer = self.instance.media_player_new()
+        self.standby: vlc.MediaPlayer = self.instance.media_player_new()
+        self.volume: int = volume
+        self.media_player.audio_set_volume(volume)
+
+        self.mailbox: Mailbox = Mailbox(self.queue.notify)
+
+        self.current_song: Song | None = None
+        self.paused: bool = False
+        # Song loaded in the standby media player, if any
+        self.prebuffered: Song | None = None
+        # Reader of the track loaded in each media player, when it is not a cached file
+        self._readers: dict[vlc.MediaPlayer, TrackReader] = {}
+
+        # Flags written by the VLC callbacks before they wake up the playback thread
+        self._idle: bool = True
+        self._half_played: bool = False
+        self._prebuffer_due: bool = False
+        self._scrobbled: bool = True
+        self._stopped: bool = False
+
+        for media_player in (self.media_player, self.standby):
+            event_manager = media_player.event_manager()
+            event_manager.event_attach(
+                vlc.EventType.MediaPlayerEndReached, self._on_end, media_player
+            )
+            event_manager.event_attach(
+                vlc.EventType.MediaPlayerEncounteredError, self._on_error, media_player
+            )
+            event_manager.event_attach(
+                vlc.EventType.MediaPlayerTimeChanged, self._on_time, media_player
+            )
+
+        self.events.publish("track", {"song": None})
+        self.events.publish("pause", {"paused": False})
+        self.events.publish("volume", {"volume": volume})
+        self._publish_queue()
+
+    def _on_end(self, event: vlc.Event, media_player: vlc.MediaPlayer) -> None:
+        if media_player is not self.media_player:
+            return
+        self._idle = True
+        self.queue.notify()
+
+    def _on_error(self, event: vlc.Event, media_player: vlc.MediaPlayer) -> None:
+        if media_player is not self.media_player:
+            # A failed pre-buffer is retried as a normal start once the song is reached
+            self.prebuffered = None
+            return
+        self.logger.warn("VLC failed to play the current song")
+        self._idle = True
+        self.queue.notify()
+
+    def _on_time(self, event: vlc.Event, media_player: vlc.MediaPlayer) -> None:
+        if media_player is not self.media_player or self.current_song is None:
+            return
+
+        # The duration comes from the server, VLC does not know the length of a track it
+        # reads through callbacks
+        try:
+            duration = float(self.current_song.duration)
+        except (TypeError, ValueError):
+            return
+        elapsed: float = event.u.new_time / 1000
+
+        # Time events arrive several times a second, only wake up once per milestone
+        if not self._half_played and elapsed > duration / 2:
+            self._half_played = True
+            self.queue.notify()
+
+        if not self._prebuffer_due and self.prebuffered is None:
+            if duration - elapsed <= self.prebuffer_seconds:
+                self._prebuffer_due = True
+                self.queue.notify()
+
+    def submit(self, command: Command) -> Future:
+        """Send a command to the playback thread, the future resolves once it has run"""
+
+        return self.mailbox.submit(command)
+
+    def stop(self) -> Future:
+        """Stop the playback thread"""
+
+        return self.submit(Stop())
+
+    def handle(self, command: Command):
+        """Run a command, must be called from the playback thread"""
+
+        match command:
+            case Enqueue(songs=songs):
+                self.queue.extend(songs)
+                self._publish_queue()
+            case Skip():
+                # Returns False if nothing is playing
+                if self._idle:
+                    return False
+                self.logger.info("Skipping the current song")
+                self._stop(self.media_player)
+                self._idle = True
+                return True
+            case TogglePause():
+                # Returns False if nothing is playing
+                if self._idle:
+                    return False
+                self.media_player.pause()
+                self.paused = not self.paused
+                self.events.publish("pause", {"paused": self.paused})
+                return True
+            case Shuffle():
+                self.queue.shuffle()
+                self._publish_queue()
+            case Clear():
+                self.queue.clear()
+                self._publish_queue()
+            case ChangeVolume(amount=amount, set=set):
+                # Returns the new volume, which is kept between the bounds
+                volume = amount if set else self.volume + amount
+                self.volume = min(max(volume, MIN_VOLUME), MAX_VOLUME)
+                self.media_player.audio_set_volume(self.volume)
+                self.events.publish("volume", {"volume": self.volume})
+                return self.volume
+            case Stop():
+                self._stopped = True
+            case _:
+                raise TypeError(f"Unknown player command {command!r}")
+
+    def handle_mailbox(self) -> None:
+        for command, futures in self.mailbox.drain():
+            try:
+                result = self.handle(command)
+            except Exception as e:  # noqa
+                # We use a broad exception as the submitters must get an answer either way
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future in futures:
+                future.set_result(result)
+
+    def _publish_queue(self) -> None:
+        self.events.publish(
+            "queue", {"version": self.queue.version, "length": len(self.queue)}
+        )
+
+    def _has_work(self) -> bool:
+        return (
+            self._stopped
+            or bool(self.mailbox)
+            or (self._idle and (bool(self.queue) or self.current_song is not None))
+            or (self._half_played and not self._scrobbled)
+            or (self._prebuffer_due and self.prebuffered is None and bool(self.queue))
+        )
+
+    def run(self) -> None:
+        """Playback loop, blocks the calling thread until stop is called"""
+
+        while True:
+            self.queue.wait_for(self._has_work)
+            self.handle_mailbox()
+            if self._stopped:
+                return
+
+            if self._half_played and not self._scrobbled:
+                self._scrobbled = True
+                self.subsonic.scrobbler.submit(self.current_song.id)
+
+            if self._idle:
+                song = self.queue.pop()
+                if song is not None:
+                    self._publish_queue()
+                    self.play(song)
+                elif self.current_song is not None:
+                    # The last queued song ended or was skipped
+                    self.current_song = None
+                    self.paused = False
+                    self.events.publish("track", {"song": None})
+            elif self._prebuffer_due and self.prebuffered is None:
+                self.prebuffer()
+
+    def media_for(self, song: Song, media_player: vlc.MediaPlayer) -> vlc.Media:
+        """Media of a song for a media player, read from the audio cache when it holds the
+        track. Otherwise VLC reads the stream through a reader that fills the cache"""
+
+        audio_cache = self.subsonic.audio_cache
+        if audio_cache is None:
+            return self.instance.media_new(song.stream_url)
+
+        path = audio_cache.lookup(song.id)
+        if path is not None:
+            audio_cache.served(os.path.getsize(path))
+            return self.instance.media_new_path(path)
+
+        reader = TrackReader(self.subsonic, song.id, audio_cache)
+        handle = next(_handles)
+        _readers[handle] = reader
+        self._readers[media_player] = reader
+        # Without an open callback the handle is given to the other callbacks as is
+        return self.instance.media_new_callbacks(
+            None, _read_track, _seek_track, _close_track, handle
+        )
+
+    def _stop(self, media_player: vlc.MediaPlayer) -> None:
+        """Stop a media player, a read blocked on the network would otherwise hold it"""
+
+        reader = self._readers.pop(media_player, None)
+        if reader is not None:
+            reader.abort()
+        media_player.stop()
+
+    def prebuffer(self) -> None:
+        """Open the next queued song in the standby media player, paused at its start"""
+
+        self._prebuffer_due = False
+        song = self.queue.peek()
+        if song is None:
+            return
+
+        media = self.media_for(song, self.standby)
+        media.add_option(":start-paused")
+        self.standby.audio_set_volume(self.volume)
+        self.standby.set_media(media)
+        self.standby.play()
+        self.prebuffered = song
+        self.logger.info(f"Pre-buffering {song.title} | {song.artist} | {song.album}")
+
+    def play(self, song: Song) -> None:
+        """Start playing a song right away, must be called from the playback thread"""
+
+        self.current_song = song
+        self._half_played = False
+        self._prebuffer_due = False
+        self._scrobbled = False
+        self._idle = False
+        self.paused = False
+
+        if song is self.prebuffered:
+            # Swap to the media player that already buffered the song and resume it
+            self.media_player, self.standby = self.standby, self.media_player
+            self._stop(self.standby)
+            self.media_player.audio_set_volume(self.volume)
+            self.media_player.set_pause(0)
+        else:
+            if self.prebuffered is not None:
+                # The queue changed since the song was pre-buffered
+                self._stop(self.standby)
+            self._readers.pop(self.media_player, None)
+            media = self.media_for(song, self.media_player)
+            self.media_player.set_media(media)
+            self.media_player.play()
+        self.prebuffered = None
+
+        self.subsonic.scrobbler.now_playing(song.id)
+        self.events.publish("track", {"song": song})
+        self.events.publish("pause", {"paused": False})
+        self.logger.info(f"Now playing {song.title} | {song.artist} | {song.album}")
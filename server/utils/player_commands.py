@@ -0,0 +1,130 @@
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from threading import Lock
+from typing import Callable
+
+from .subsonic import Song
+
+# Bounds the volume is kept between after every change
+MIN_VOLUME = 0
+MAX_VOLUME = 200
+
+
+@dataclass(frozen=True, slots=True)
+class Command:
+    """A request for the player thread, the only thread that touches VLC and the queue"""
+
+    def coalesce(self, newer: "Command") -> "Command | None":
+        """Merge a command submitted right after this one into a single command, or None if
+        both must run"""
+
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class Enqueue(Command):
+    songs: tuple[Song, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class Skip(Command):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class TogglePause(Command):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class Shuffle(Command):
+    def coalesce(self, newer: Command) -> Command | None:
+        return self if isinstance(newer, Shuffle) else None
+
+
+@dataclass(frozen=True, slots=True)
+class Clear(Command):
+    def coalesce(self, newer: Command) -> Command | None:
+        return self if isinstance(newer, Clear) else None
+
+
+@dataclass(frozen=True, slots=True)
+class ChangeVolume(Command):
+    """Increase the volume by amount, or set it to amount"""
+
+    amount: int
+    set: bool = False
+
+    def coalesce(self, newer: Command) -> Command | None:
+        if not isinstance(newer, ChangeVolume):
+            return None
+        if newer.set:
+            return newer
+        if self.set:
+            # The volume this sets is known, so it is clamped before the step is added
+            volume = min(max(self.amount, MIN_VOLUME), MAX_VOLUME)
+            return ChangeVolume(volume + newer.amount, set=True)
+        if (self.amount < 0) != (newer.amount < 0):
+            # Each step is clamped, a step that hits a bound is not undone by the next one
+            return None
+        return ChangeVolume(self.amount + newer.amount)
+
+
+@dataclass(frozen=True, slots=True)
+class Stop(Command):
+    pass
+
+
+class Mailbox:
+    """
+    Commands waiting for the player thread, in submission order.
+
+    Every command gets a future for its result. A command that can be merged with the one
+    submitted just before it, like repeated volume steps, is folded into it and both futures
+    get the result of the merged command.
+    """
+
+    def __init__(self, notify: Callable[[], None]) -> None:
+        self.notify: Callable[[], None] = notify
+
+        self._lock: Lock = Lock()
+        self._commands: deque[tuple[Command, list[Future]]] = deque()
+
+        self.submitted: int = 0
+        self.coalesced: int = 0
+
+    def __bool__(self) -> bool:
+        return bool(self._commands)
+
+    def submit(self, command: Command) -> Future:
+        future: Future = Future()
+        with self._lock:
+            self.submitted += 1
+            if self._commands:
+                last, futures = self._commands[-1]
+                merged = last.coalesce(command)
+                if merged is not None:
+                    self.coalesced += 1
+                    self._commands[-1] = (merged, futures + [future])
+                    command = None
+            if command is not None:
+                self._commands.append((command, [future]))
+        self.notify()
+        return future
+
+    def drain(self) -> list[tuple[Command, list[Future]]]:
+        """Take every waiting command, called by the player thread"""
+
+        with self._lock:
+            commands = list(self._commands)
+            self._commands.clear()
+        return commands
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "waiting": len(self._commands),
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+            }
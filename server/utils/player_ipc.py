@@ -0,0 +1,330 @@
+import os
+import secrets
+import tempfile
+import threading
+import time
+from dataclasses import fields
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import TYPE_CHECKING, Any, Sequence
+
+from .events import EventBus
+from .subsonic import Links, Song
+
+if TYPE_CHECKING:
+    from .logging import Logger
+    from .player_service import PlayerService
+
+# Methods of PlayerService that can be called over the socket
+COMMANDS: frozenset[str] = frozenset(
+    {
+        "enqueue",
+        "skip",
+        "toggle_pause",
+        "shuffle",
+        "clear",
+        "volume",
+        "change_volume",
+        "queue_etag",
+        "queue_page",
+    }
+)
+
+# Seconds between heartbeats on an idle event stream, which detect a vanished worker
+EVENTS_HEARTBEAT = 15
+# Seconds a worker waits before subscribing again after losing the daemon
+EVENTS_RETRY = 2
+
+# Suffix of the file next to the socket holding the generated authkey
+AUTHKEY_SUFFIX = ".key"
+
+SONG_FIELDS: tuple[str, ...] = tuple(
+    field.name for field in fields(Song) if field.name != "links"
+)
+
+
+class PlayerUnavailable(Exception):
+    """The player daemon could not be reached"""
+
+
+class PackedSong:
+    """A Song without its links, which hold the credentials and locks of one process"""
+
+    __slots__ = ("values",)
+
+    def __init__(self, values: tuple) -> None:
+        self.values: tuple = values
+
+    def __reduce__(self):
+        return PackedSong, (self.values,)
+
+
+def write_authkey(address: str) -> bytes:
+    """Generate an authkey for the socket at address, in a file only this user can read"""
+
+    authkey = secrets.token_bytes(32)
+    # mkstemp creates the file readable and writable by its owner only
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(address) or ".")
+    with os.fdopen(descriptor, "wb") as file:
+        file.write(authkey)
+    os.replace(temporary, f"{address}{AUTHKEY_SUFFIX}")
+    return authkey
+
+
+def read_authkey(address: str) -> bytes:
+    """Read the authkey the daemon generated for the socket at address"""
+
+    with open(f"{address}{AUTHKEY_SUFFIX}", "rb") as file:
+        return file.read()
+
+
+def pack(value: Any) -> Any:
+    """Prepare a value to be sent over the socket"""
+
+    if isinstance(value, Song):
+        return PackedSong(tuple(getattr(value, name) for name in SONG_FIELDS))
+    if isinstance(value, (list, tuple)):
+        return type(value)(pack(item) for item in value)
+    if isinstance(value, dict):
+        return {key: pack(item) for key, item in value.items()}
+    return value
+
+
+def unpack(value: Any, links: Links) -> Any:
+    """Restore a value received over the socket, songs get the links of this process"""
+
+    if isinstance(value, PackedSong):
+        return Song(**dict(zip(SONG_FIELDS, value.values)), links=links)
+    if isinstance(value, (list, tuple)):
+        return type(value)(unpack(item, links) for item in value)
+    if isinstance(value, dict):
+        return {key: unpack(item, links) for key, item in value.items()}
+    return value
+
+
+class PlayerServer:
+    """
+    Serves a PlayerService to API workers over a Unix socket, so one player daemon owns VLC
+    and the queue while any number of worker processes handle requests.
+
+    Every connection is served by its own thread, calls are (method, args, kwargs) messages
+    answered with ("ok", result), ("unavailable", message) when the playback thread did not
+    answer in time, or ("error", message). A connection that calls subscribe receives the
+    player events as (type, data) messages from then on, with None sent as a heartbeat while
+    there are none.
+
+    Messages are pickled, so connections must always prove they know the authkey before
+    anything is read from them. Without a configured authkey a new one is generated on start
+    and written next to the socket, and both files are only accessible to this user.
+    """
+
+    def __init__(
+        self,
+        service: "PlayerService",
+        address: str,
+        links: Links,
+        logger: "Logger",
+        authkey: bytes | None = None,
+    ) -> None:
+        self.service: "PlayerService" = service
+        self.address: str = address
+        self.links: Links = links
+        self.logger: "Logger" = logger
+        self.authkey: bytes | None = authkey
+        self._listener: Listener | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if os.path.exists(self.address):
+            # Left behind by a previous daemon
+            os.remove(self.address)
+        authkey = self.authkey or write_authkey(self.address)
+        self._listener = Listener(self.address, family="AF_UNIX", authkey=authkey)
+        os.chmod(self.address, 0o600)
+        self._thread = threading.Thread(
+            target=self._accept, name="player-server", daemon=True
+        )
+        self._thread.start()
+        self.logger.info(f"Serving the player on {self.address}")
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                connection = self._listener.accept()
+            except (OSError, AuthenticationError) as e:
+                # Failed handshakes, for example with a wrong authkey
+                self.logger.warn(f"Refused a player connection: {e}")
+                continue
+            threading.Thread(
+                target=self._serve,
+                args=(connection,),
+                name="player-connection",
+                daemon=True,
+            ).start()
+
+    def _serve(self, connection: Connection) -> None:
+        with connection:
+            while True:
+                try:
+                    method, args, kwargs = connection.recv()
+                except (EOFError, OSError):
+                    return
+
+                if method == "subscribe":
+                    self._stream_events(connection)
+                    return
+                if method not in COMMANDS:
+                    connection.send(("error", f"Unknown player command {method}"))
+                    continue
+                try:
+                    result = getattr(self.service, method)(
+                        *unpack(args, self.links), **kwargs
+                    )
+                except PlayerUnavailable as e:
+                    connection.send(("unavailable", str(e)))
+                    continue
+                except Exception as e:  # noqa
+                    # We use a broad exception as the worker must get an answer either way
+                    connection.send(("error", f"{type(e).__name__}: {e}"))
+                    continue
+                connection.send(("ok", pack(result)))
+
+    def _stream_events(self, connection: Connection) -> None:
+        with self.service.events.subscribe() as subscription:
+            while True:
+                events = subscription.get(EVENTS_HEARTBEAT)
+                try:
+                    if not events:
+                        connection.send(None)
+                    for event in events:
+                        connection.send((event.type, pack(event.data)))
+                except OSError:
+                    return
+
+
+class PlayerClient:
+    """
+    Talks to a PlayerServer in the player daemon, with the same methods as PlayerService.
+
+    Each thread keeps its own connection, which is opened on first use and opened again
+    after the daemon restarts. Once started, a background thread subscribes to the player
+    events of the daemon and publishes them on the event bus of this process. Without an
+    authkey, the one the daemon generated is read again for every new connection.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        links: Links,
+        authkey: bytes | None = None,
+        event_buffer: int = 64,
+    ) -> None:
+        self.address: str = address
+        self.links: Links = links
+        self.authkey: bytes | None = authkey
+        self.events: EventBus = EventBus(event_buffer)
+        self._local: threading.local = threading.local()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Start forwarding the player events if it is not already running"""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._forward_events, name="player-events", daemon=True
+        )
+        self._thread.start()
+
+    def _forward_events(self) -> None:
+        while True:
+            try:
+                with Client(
+                    self.address, family="AF_UNIX", authkey=self._authkey()
+                ) as connection:
+                    connection.send(("subscribe", (), {}))
+                    while True:
+                        message = connection.recv()
+                        if message is not None:
+                            type, data = message
+                            self.events.publish(type, unpack(data, self.links))
+            except (EOFError, OSError, AuthenticationError):
+                # The daemon is down or restarting, it replays its state on the next subscribe
+                time.sleep(EVENTS_RETRY)
+
+    def _authkey(self) -> bytes:
+        return self.authkey or read_authkey(self.address)
+
+    def _connection(self) -> Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            try:
+                connection = Client(
+                    self.address, family="AF_UNIX", authkey=self._authkey()
+                )
+            except (OSError, AuthenticationError) as e:
+                raise PlayerUnavailable(str(e)) from e
+            self._local.connection = connection
+        return connection
+
+    def _drop(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection.close()
+
+    def call(self, method: str, *args, **kwargs) -> Any:
+        message = (method, pack(args), kwargs)
+        try:
+            self._connection().send(message)
+        except OSError:
+            # The daemon restarted since the last call, the command was not delivered
+            self._drop()
+            try:
+                self._connection().send(message)
+            except OSError as e:
+                self._drop()
+                raise PlayerUnavailable(str(e)) from e
+        try:
+            status, result = self._connection().recv()
+        except (EOFError, OSError) as e:
+            # The command may or may not have run, it is not sent again
+            self._drop()
+            raise PlayerUnavailable(str(e)) from e
+
+        if status == "unavailable":
+            raise PlayerUnavailable(result)
+        if status == "error":
+            raise RuntimeError(result)
+        return unpack(result, self.links)
+
+    def enqueue(self, songs: Sequence[Song]) -> None:
+        self.call("enqueue", list(songs))
+
+    def skip(self) -> bool:
+        return self.call("skip")
+
+    def toggle_pause(self) -> bool:
+        return self.call("toggle_pause")
+
+    def shuffle(self) -> None:
+        self.call("shuffle")
+
+    def clear(self) -> None:
+        self.call("clear")
+
+    def volume(self) -> int:
+        return self.call("volume")
+
+    def change_volume(self, amount: int, set: bool = False) -> int:
+        return self.call("change_volume", amount, set=set)
+
+    def queue_etag(self) -> str:
+        return self.call("queue_etag")
+
+    def queue_page(
+        self, offset: int = 0, limit: int = 50, after: int | None = None
+    ) -> tuple[list[tuple[int, Song]], int, int, int, str]:
+        return self.call("queue_page", offset, limit, after)
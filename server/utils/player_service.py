@@ -0,0 +1,106 @@
+import secrets
+from concurrent.futures import TimeoutError
+from typing import Sequence
+
+from .events import EventBus
+from .logging import Logger
+from .playback_queue import PlaybackQueue
+from .player import Player
+from .player_commands import (
+    ChangeVolume,
+    Clear,
+    Command,
+    Enqueue,
+    Shuffle,
+    Skip,
+    TogglePause,
+)
+from .player_ipc import PlayerUnavailable
+from .subsonic import Song, Subsonic
+
+# Seconds a request waits for the playback thread to run its command
+COMMAND_TIMEOUT = 5
+
+
+class PlayerService:
+    """
+    The playback state of the server: the queue and the player that plays it.
+
+    Endpoints only go through the methods of this class, which are the same as those of
+    PlayerClient, so the player can run in the API process or in a separate player daemon.
+    Changes are sent as commands to the playback thread and wait for it to run them, reads
+    are answered from the thread safe queue and the last applied volume.
+    """
+
+    def __init__(
+        self,
+        subsonic: Subsonic,
+        logger: Logger,
+        prebuffer_seconds: float = 10,
+        event_buffer: int = 64,
+    ) -> None:
+        self.queue: PlaybackQueue[Song] = PlaybackQueue()
+        self.events: EventBus = EventBus(event_buffer)
+        self.player: Player = Player(
+            self.queue,
+            subsonic,
+            logger,
+            self.events,
+            prebuffer_seconds=prebuffer_seconds,
+        )
+        # Keeps ETags issued before a restart from matching the new queue versions
+        self.epoch: str = secrets.token_hex(4)
+
+    def run(self) -> None:
+        """Playback loop, blocks the calling thread"""
+
+        self.player.run()
+
+    def command(self, command: Command):
+        """Run a command on the playback thread and return its result"""
+
+        try:
+            return self.player.submit(command).result(COMMAND_TIMEOUT)
+        except TimeoutError as e:
+            raise PlayerUnavailable("The playback thread did not answer in time") from e
+
+    def enqueue(self, songs: Sequence[Song]) -> None:
+        self.command(Enqueue(tuple(songs)))
+
+    def skip(self) -> bool:
+        """Skip the current song, returns False if nothing is playing"""
+
+        return self.command(Skip())
+
+    def toggle_pause(self) -> bool:
+        """Pause or resume the current song, returns False if nothing is playing"""
+
+        return self.command(TogglePause())
+
+    def shuffle(self) -> None:
+        self.command(Shuffle())
+
+    def clear(self) -> None:
+        self.command(Clear())
+
+    def volume(self) -> int:
+        return self.player.volume
+
+    def change_volume(self, amount: int, set: bool = False) -> int:
+        """Increase the volume by amount, or set it to amount. Returns the new volume, which
+        is kept between 0 and 200"""
+
+        return self.command(ChangeVolume(amount, set))
+
+    def queue_etag(self) -> str:
+        """ETag of the current queue version"""
+
+        return f"{self.epoch}-{self.queue.version}"
+
+    def queue_page(
+        self, offset: int = 0, limit: int = 50, after: int | None = None
+    ) -> tuple[list[tuple[int, Song]], int, int, int, str]:
+        """A page of the queue, see PlaybackQueue.page, followed by the ETag of its version"""
+
+        entries, start, total, version = self.queue.page(offset, limit, after)
+        return entries, start, total, version, f"{self.epoch}-{version}"
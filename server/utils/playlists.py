@@ -0,0 +1,117 @@
+import bisect
+import time
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .subsonic import Subsonic
+
+# Seconds after a refresh during which a lookup miss does not refresh the index again
+MISS_REFRESH_INTERVAL = 10
+
+
+class PlaylistIndex:
+    """
+    Cached index of the playlists on the server, refreshed in the background.
+
+    Playlists are matched by name ignoring case, preferring an exact match, then the
+    alphabetically first name starting with the query, then the first name containing it.
+    A lookup that matches nothing refreshes the index once, so playlists created since the
+    last refresh are found. Without the background refresh, for example in API workers that
+    would each poll the server, a lookup refreshes an index older than the refresh interval.
+    """
+
+    def __init__(self, client: "Subsonic", refresh_interval: float = 600) -> None:
+        self.client: "Subsonic" = client
+        self.refresh_interval: float = refresh_interval
+
+        self._lock: Lock = Lock()
+        self._by_name: dict[str, dict] = {}
+        # Lowercase names kept sorted for prefix lookups
+        self._names: list[str] = []
+        self.loaded: bool = False
+        self.refreshed_at: float = 0
+
+        self._stop: Event = Event()
+        self._thread: Thread | None = None
+
+    def start(self) -> None:
+        """Start refreshing the index in the background every refresh interval"""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="subsonic-playlists", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:  # noqa
+                # The previous index is kept until the next refresh succeeds
+                self.client.warn(f"Failed to refresh the playlists: {e}")
+            self._stop.wait(self.refresh_interval)
+
+    def refresh(self) -> None:
+        playlists: dict = self.client.data_request(
+            "/getPlaylists", self.client.params, "playlists"
+        )
+
+        by_name: dict[str, dict] = {}
+        for playlist in playlists.get("playlist", []):
+            # Keep the first playlist when several share a name
+            by_name.setdefault(playlist.get("name", "").casefold(), playlist)
+
+        with self._lock:
+            self._by_name = by_name
+            self._names = sorted(by_name)
+            self.loaded = True
+            self.refreshed_at = time.monotonic()
+
+    def find(self, query: str) -> dict | None:
+        """Returns the raw attributes of the best matching playlist or None"""
+
+        with self._lock:
+            expired = time.monotonic() - self.refreshed_at > self.refresh_interval
+        if not self.loaded:
+            self.refresh()
+        elif expired:
+            try:
+                self.refresh()
+            except Exception as e:  # noqa
+                # The previous index still answers until a refresh succeeds
+                self.client.warn(f"Failed to refresh the playlists: {e}")
+
+        query = query.casefold()
+        playlist = self._lookup(query)
+        if playlist is None:
+            with self._lock:
+                stale = time.monotonic() - self.refreshed_at > MISS_REFRESH_INTERVAL
+            if stale:
+                self.refresh()
+                playlist = self._lookup(query)
+
+        return playlist
+
+    def _lookup(self, query: str) -> dict | None:
+        with self._lock:
+            playlist = self._by_name.get(query)
+            if playlist is not None:
+                return playlist
+
+            position = bisect.bisect_left(self._names, query)
+            if position < len(self._names) and self._names[position].startswith(query):
+                return self._by_name[self._names[position]]
+
+            for name in self._names:
+                if query in name:
+                    return self._by_name[name]
+
+        return None
+
+    def __len__(self) -> int:
+        return len(self._names)
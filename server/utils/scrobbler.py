@@ -0,0 +1,173 @@
+import json
+import os
+import time
+from collections import deque
+from threading import Condition, Thread
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .subsonic import Subsonic
+
+
+class ScrobbleDispatcher:
+    """
+    Sends scrobbles to the server from a background thread so playback never waits on it.
+
+    Submissions are kept in order, sent in batches and retried with exponential backoff until
+    the server accepts them. They are written to a spool file while pending, so they survive
+    restarts and outages. Only the latest "now playing" update is kept, older ones are
+    superseded and never sent.
+    """
+
+    def __init__(
+        self,
+        client: "Subsonic",
+        spool_path: str | None = None,
+        batch_size: int = 50,
+        backoff: float = 1,
+        max_backoff: float = 300,
+        now_playing_retries: int = 3,
+    ) -> None:
+        self.client: "Subsonic" = client
+        self.spool_path: str | None = spool_path
+        self.batch_size: int = batch_size
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self.now_playing_retries: int = now_playing_retries
+
+        self._changed: Condition = Condition()
+        # (song ID, time in milliseconds since the epoch)
+        self._submissions: deque[tuple[str, int]] = deque(self._load())
+        self._now_playing: str | None = None
+        self._now_playing_attempts: int = 0
+        self._retry_at: float = 0
+        self._failures: int = 0
+        self._thread: Thread | None = None
+
+        self.sent: int = 0
+        self.rejected: int = 0
+        self.superseded: int = 0
+
+    def _load(self) -> list[tuple[str, int]]:
+        if self.spool_path is None or not os.path.exists(self.spool_path):
+            return []
+        with open(self.spool_path, encoding="utf-8") as spool:
+            return [tuple(json.loads(line)) for line in spool if line.strip()]
+
+    def _save(self) -> None:
+        """Rewrite the spool file with the pending submissions, the lock must be held"""
+
+        if self.spool_path is None:
+            return
+        temporary = f"{self.spool_path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as spool:
+            spool.writelines(
+                f"{json.dumps(submission)}\n" for submission in self._submissions
+            )
+        os.replace(temporary, self.spool_path)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = Thread(target=self._run, name="subsonic-scrobbler", daemon=True)
+        self._thread.start()
+
+    def now_playing(self, id: str) -> None:
+        """Report a song as playing, replaces any report that has not been sent yet"""
+
+        with self._changed:
+            if self._now_playing is not None:
+                self.superseded += 1
+            self._now_playing = id
+            self._now_playing_attempts = 0
+            self._changed.notify_all()
+
+    def submit(self, id: str, played_at: float | None = None) -> None:
+        """Queue a submission for a song played at the given epoch time, defaults to now"""
+
+        with self._changed:
+            self._submissions.append((id, int((played_at or time.time()) * 1000)))
+            if self.spool_path is not None:
+                with open(self.spool_path, "a", encoding="utf-8") as spool:
+                    spool.write(f"{json.dumps(self._submissions[-1])}\n")
+            self._changed.notify_all()
+
+    def _has_work(self) -> bool:
+        return self._now_playing is not None or bool(self._submissions)
+
+    def _answered(self, submissions: list[tuple[str, int]], accepted: bool) -> None:
+        """Drop submissions the server answered from the front of the queue"""
+
+        with self._changed:
+            if accepted:
+                self.sent += len(submissions)
+            else:
+                self.rejected += len(submissions)
+            for _ in submissions:
+                self._submissions.popleft()
+            self._save()
+        if not accepted:
+            self.client.warn(f"{len(submissions)} scrobble(s) were rejected")
+
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                self._changed.wait_for(self._has_work)
+                # A new now playing report interrupts the backoff and is sent on its own,
+                # submissions and reports that already failed wait it out
+                delay = self._retry_at - time.monotonic()
+                backing_off = delay > 0
+                if backing_off and (
+                    self._now_playing is None or self._now_playing_attempts
+                ):
+                    self._changed.wait(delay)
+                    continue
+                now_playing = self._now_playing
+                batch = (
+                    [] if backing_off else list(self._submissions)[: self.batch_size]
+                )
+
+            try:
+                if now_playing is not None:
+                    if not self.client.scrobble(now_playing, False):
+                        self.client.warn(f'Now playing "{now_playing}" was rejected')
+                    with self._changed:
+                        if self._now_playing == now_playing:
+                            self._now_playing = None
+                if batch:
+                    # A rejection is an answer from the server, retrying would not change it.
+                    # One bad ID rejects the whole batch, so a rejected batch is sent again
+                    # one submission at a time and only the bad ones are dropped
+                    accepted = self.client.scrobble_many(batch)
+                    if not accepted and len(batch) > 1:
+                        for submission in batch:
+                            self._answered(
+                                [submission], self.client.scrobble_many([submission])
+                            )
+                    else:
+                        self._answered(batch, accepted)
+                if not backing_off:
+                    self._failures = 0
+                    self._retry_at = 0
+            except Exception as e:  # noqa
+                # We use a broad exception as there are a variety of Connection* errors that can be raised
+                self._failures += 1
+                delay = min(self.backoff * 2 ** (self._failures - 1), self.max_backoff)
+                self._retry_at = time.monotonic() + delay
+                self.client.warn(f"Failed to scrobble, retrying in {delay:.1f}s: {e}")
+                with self._changed:
+                    if self._now_playing == now_playing and now_playing is not None:
+                        self._now_playing_attempts += 1
+                        if self._now_playing_attempts >= self.now_playing_retries:
+                            # Now playing reports are only useful while they are current
+                            self._now_playing = None
+
+    def stats(self) -> dict[str, int]:
+        with self._changed:
+            return {
+                "pending": len(self._submissions),
+                "sent": self.sent,
+                "rejected": self.rejected,
+                "superseded": self.superseded,
+                "failures": self._failures,
+            }
@@ -1,67 +1,264 @@
-import urllib
+import json
+import os
+import sys
+import tempfile
+import urllib.parse
 import xml.etree.ElementTree as ET
 from dataclasses import dataclass, field
-from typing import Callable
+from typing import Callable, Iterator, TypeVar
 
 import requests
 from colorama import Fore, Style
 
+from .audio_cache import AudioCache
 from .authentication import Auth
+from .cache import MISSING, DiskCache, SearchCache, TieredCache, TTLCache
+from .concurrency import fan_out
+from .cover_cache import CoverCache
 from .config import SUBSONIC_CONFIG as CONFIG
+from .fuzzy import TrigramIndex
+from .health import HealthMonitor
+from .library import Library
 from .messages import info, warn, error
+from .playlists import PlaylistIndex
+from .scrobbler import ScrobbleDispatcher
+from .transport import Transport
 
+try:
+    # orjson is optional, it decodes JSON responses several times faster
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
-@dataclass()
+T = TypeVar("T")
+
+
+def stringify(value):
+    """Convert the numbers and booleans of a JSON payload to the strings used in XML"""
+
+    kind = type(value)
+    if kind is dict:
+        return {
+            key: item if type(item) is str else stringify(item)
+            for key, item in value.items()
+        }
+    if kind is list:
+        return [stringify(item) for item in value]
+    if kind is bool:
+        return "true" if value else "false"
+    if kind is int or kind is float:
+        return str(value)
+    return value
+
+
+# Error code of the Subsonic API for data that does not exist
+NOT_FOUND = 70
+
+
+class SubsonicError(Exception):
+    """The server answered with a failed status, or without the requested payload"""
+
+    def __init__(self, code: int | None, message: str) -> None:
+        super().__init__(f"Error {code}: {message}" if code is not None else message)
+        self.code: int | None = code
+        self.message: str = message
+
+
+def intern(value: str | None) -> str | None:
+    """Share one copy of strings repeated across many models, such as artist names"""
+
+    return sys.intern(value) if value is not None else None
+
+
+class Links:
+    """
+    Builds the URLs of models from the pre-encoded credentials of the client, shared by
+    every model.
+
+    Models only keep the IDs and build URLs when they are read, so large results do not pay
+    for URLs nobody asks for.
+    """
+
+    __slots__ = ("url", "auth")
+
+    def __init__(self, url: str, auth: Auth) -> None:
+        self.url: str = url
+        self.auth: Auth = auth
+
+    def build(self, subroute: str, id: str | None) -> str:
+        id = urllib.parse.quote_plus(id or "")
+        return f"{self.url}/rest{subroute}?{self.auth.query()}&id={id}"
+
+    def stream(self, id: str | None) -> str:
+        return self.build("/stream", id)
+
+    def cover(self, id: str | None) -> str:
+        return self.build("/getCoverArt", id)
+
+
+@dataclass(frozen=True, slots=True)
 class Song:
     """Song model"""
 
     title: str
-    stream_url: str
     artist: str
     album: str
-    cover: str
     duration: str
     track: str
     year: str
     genre: str
     id: str
+    cover_id: str | None = None
+    links: Links | None = field(default=None, repr=False, compare=False)
+
+    @property
+    def stream_url(self) -> str:
+        return self.links.stream(self.id)
 
+    @property
+    def cover(self) -> str:
+        return self.links.cover(self.cover_id)
 
-@dataclass()
+
+@dataclass(frozen=True, slots=True)
 class Album:
     """Album model"""
 
     id: str
     title: str
     artist: str
-    cover: str
     year: str
     genre: str
-    songs: list[Song] = field(default_factory=list)
+    songs: tuple[Song, ...] = ()
+    cover_id: str | None = None
+    links: Links | None = field(default=None, repr=False, compare=False)
+
+    @property
+    def cover(self) -> str:
+        return self.links.cover(self.cover_id)
 
 
-@dataclass()
+@dataclass(frozen=True, slots=True)
 class Artist:
     """Artist model"""
 
     id: str
     name: str
-    albums: list[Album]
+    albums: tuple[Album, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class SearchResult:
+    """Combined search result model"""
+
+    songs: tuple[Song, ...] = ()
+    albums: tuple[Album, ...] = ()
+    artists: tuple[Artist, ...] = ()
 
 
 class Subsonic:
     def __init__(self) -> None:
-        self.auth: Auth = Auth()
+        self.auth: Auth = Auth(
+            CONFIG["user"]["username"],
+            CONFIG["user"]["password"],
+            pool_size=CONFIG.get("auth", {}).get("poolSize", 0),
+        )
         self.url: str = CONFIG["subsonicUrl"]
+        # Wire format of the API responses, either "xml" or "json"
+        self.format: str = CONFIG.get("format", "xml")
+
+        http_config: dict = CONFIG.get("http", {})
+        self.transport: Transport = Transport(
+            self.url,
+            pool_size=http_config.get("poolSize", 10),
+            connect_timeout=http_config.get("connectTimeout", 3.05),
+            read_timeout=http_config.get("readTimeout", 10),
+            retries=http_config.get("retries", 3),
+            backoff=http_config.get("backoff", 0.3),
+        )
+        self.health: HealthMonitor = HealthMonitor(
+            self.ping, interval=CONFIG.get("healthInterval", 30)
+        )
 
-        self.params: dict[str, str] = {
-            "u": CONFIG["user"]["username"],
-            "t": self.auth.token,
-            "s": self.auth.salt,
-            "v": "1.16.1",
-            # Client name
-            "c": "Rhea",
-        }
+        hydration_config: dict = CONFIG.get("hydration", {})
+        self.hydration_concurrency: int = hydration_config.get("concurrency", 8)
+        self.hydration_deadline: float = hydration_config.get("deadline", 10)
+
+        cache_config: dict = CONFIG.get("cache", {})
+        self.metadata_cache: TieredCache = TieredCache(
+            TTLCache(
+                max_size=cache_config.get("maxSize", 2048),
+                ttl=cache_config.get("ttl", 3600),
+            ),
+            (
+                DiskCache(
+                    cache_config["path"],
+                    max_size=cache_config.get("diskMaxSize", 20000),
+                    ttl=cache_config.get("diskTtl", 86400),
+                )
+                if cache_config.get("path")
+                else None
+            ),
+        )
+
+        search_cache_config: dict = CONFIG.get("searchCache", {})
+        self.search_cache: SearchCache = SearchCache(
+            max_size=search_cache_config.get("maxSize", 512),
+            ttl=search_cache_config.get("ttl", 300),
+            negative_ttl=search_cache_config.get("negativeTtl", 60),
+        )
+
+        self.links: Links = Links(self.url, self.auth)
+
+        fuzzy_config: dict = CONFIG.get("fuzzy", {})
+        self.fuzzy: TrigramIndex = TrigramIndex(
+            max_size=fuzzy_config.get("maxSize", 200000)
+        )
+        self.fuzzy_threshold: float = fuzzy_config.get("threshold", 0.6)
+
+        library_config: dict = CONFIG.get("library", {})
+        self.library: Library | None = (
+            Library(
+                self,
+                library_config["path"],
+                refresh_interval=library_config.get("refreshInterval", 3600),
+            )
+            if library_config.get("path")
+            else None
+        )
+
+        audio_cache_config: dict = CONFIG.get("audioCache", {})
+        self.audio_cache: AudioCache | None = (
+            AudioCache(
+                self,
+                audio_cache_config["path"],
+                max_bytes=audio_cache_config.get("maxSizeMb", 2048) * 1024**2,
+            )
+            if audio_cache_config.get("path")
+            else None
+        )
+
+        cover_cache_config: dict = CONFIG.get("coverCache", {})
+        self.cover_cache: CoverCache = CoverCache(
+            self,
+            cover_cache_config.get("path")
+            or os.path.join(tempfile.gettempdir(), "rhea-covers"),
+            max_bytes=cover_cache_config.get("maxSizeMb", 256) * 1024**2,
+            missing_ttl=cover_cache_config.get("missingTtl", 300),
+        )
+
+        self.playlists: PlaylistIndex = PlaylistIndex(
+            self, refresh_interval=CONFIG.get("playlistRefreshInterval", 600)
+        )
+
+        scrobble_config: dict = CONFIG.get("scrobble", {})
+        self.scrobbler: ScrobbleDispatcher = ScrobbleDispatcher(
+            self,
+            spool_path=scrobble_config.get("spoolPath"),
+            batch_size=scrobble_config.get("batchSize", 50),
+            backoff=scrobble_config.get("backoff", 1),
+            max_backoff=scrobble_config.get("maxBackoff", 300),
+        )
 
         self.info: Callable[[str], None] = lambda message: info(
             f"{Fore.MAGENTA}Subsonic{Style.RESET_ALL}", message
@@ -73,18 +270,187 @@ class Subsonic:
             f"{Fore.MAGENTA}Subsonic{Style.RESET_ALL}", message
         )
 
-    def xml_request(self, subroute: str, params: dict[str, str]) -> ET.Element:
+    @property
+    def params(self) -> dict[str, str]:
+        """Authentication parameters for a request, fresh ones every time when rotating"""
+
+        return self.auth.params()
+
+    def request(
+        self, subroute: str, params: dict[str, str], **kwargs
+    ) -> requests.Response:
         """
-        Generic request to the Subsonic API in XML.
+        Generic request to the Subsonic API, the outcome updates the health state.
 
         Subroute should come in the format of /subroute, with the slash ahead of it.
         """
 
-        r: requests.Response = requests.get(
-            url=f"{self.url}/rest{subroute}", params=params
+        try:
+            r: requests.Response = self.transport.get(subroute, params, **kwargs)
+        except requests.RequestException as e:
+            self.health.report_failure(str(e))
+            raise
+
+        if r.status_code >= 500:
+            self.health.report_failure(f"{subroute} returned status {r.status_code}")
+        else:
+            self.health.report_success()
+
+        return r
+
+    def data_request(
+        self, subroute: str, params: dict[str, str], key: str | None = None
+    ) -> dict:
+        """
+        Generic request to the Subsonic API in the configured wire format.
+
+        Returns the payload under key, for example "album" for /getAlbum, or the top level
+        attributes of the response if no key is given. Payloads have the same shape in both
+        formats: attributes map to strings and child elements are grouped in lists.
+
+        Raises SubsonicError if the server answered with a failed status or without the
+        payload, and requests.HTTPError if it did not answer with a Subsonic response.
+        """
+
+        if self.format == "json":
+            r: requests.Response = self.request(subroute, {**params, "f": "json"})
+            r.raise_for_status()
+            return self.parse_json(r.content, key)
+
+        r: requests.Response = self.request(subroute, params)
+        r.raise_for_status()
+        return self.parse_xml(r.content, key)
+
+    def parse_xml(self, body: bytes, key: str | None = None) -> dict:
+        root: ET.Element = ET.fromstring(body)
+        if root.get("status") != "ok":
+            error = root.find("{http://subsonic.org/restapi}error")
+            raise SubsonicError(
+                int(error.get("code")) if error is not None else None,
+                error.get("message", "") if error is not None else "Request failed",
+            )
+        if key is None:
+            return dict(root.attrib)
+
+        payload = root.find(f"{{http://subsonic.org/restapi}}{key}")
+        if payload is None:
+            raise SubsonicError(None, f"The response has no {key}")
+        return self.element_to_dict(payload)
+
+    def parse_json(self, body: bytes, key: str | None = None) -> dict:
+        response: dict = json_loads(body)["subsonic-response"]
+        if response.get("status") != "ok":
+            error: dict = response.get("error", {})
+            raise SubsonicError(
+                error.get("code"), error.get("message", "Request failed")
+            )
+        if key is None:
+            return {
+                name: stringify(value)
+                for name, value in response.items()
+                if not isinstance(value, (dict, list))
+            }
+
+        if key not in response:
+            raise SubsonicError(None, f"The response has no {key}")
+        return stringify(response[key])
+
+    @staticmethod
+    def is_media(r: requests.Response) -> bool:
+        """Whether a binary route such as /stream or /getCoverArt answered with media, as
+        Subsonic reports errors with an XML or JSON body"""
+
+        content_type = r.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        return not (
+            content_type.startswith("text/")
+            or content_type.endswith(("/xml", "+xml", "/json", "+json"))
         )
 
-        return ET.fromstring(r.text)
+    def is_not_found(self, r: requests.Response) -> bool:
+        """Whether a binary route such as /stream or /getCoverArt answered that the item
+        does not exist, rather than with another error"""
+
+        if r.status_code == 404:
+            return True
+        try:
+            if "json" in r.headers.get("Content-Type", ""):
+                self.parse_json(r.content)
+            else:
+                self.parse_xml(r.content)
+        except SubsonicError as e:
+            return e.code == NOT_FOUND
+        except (ET.ParseError, ValueError, KeyError):
+            pass
+        return False
+
+    def iter_request(
+        self, subroute: str, params: dict[str, str], tag: str
+    ) -> Iterator[dict[str, str]]:
+        """
+        Stream a request to the Subsonic API and yield the attributes of every element with
+        the given tag as soon as it has been parsed.
+
+        The body is parsed incrementally and yielded elements are dropped from the tree, so
+        memory stays flat no matter how large the response is. Raises SubsonicError like
+        data_request if the server answered with a failed status.
+        """
+
+        with self.request(subroute, params, stream=True) as r:
+            r.raise_for_status()
+            # Let urllib3 undo any gzip encoding while streaming
+            r.raw.decode_content = True
+
+            parents: list[ET.Element] = []
+            failed = False
+            for event, element in ET.iterparse(r.raw, events=("start", "end")):
+                if event == "start":
+                    if not parents and element.get("status") != "ok":
+                        failed = True
+                    parents.append(element)
+                    continue
+
+                parents.pop()
+                name = element.tag.rpartition("}")[2]
+                if name == "error":
+                    raise SubsonicError(
+                        int(element.get("code")), element.get("message", "")
+                    )
+                if name == tag:
+                    yield dict(element.attrib)
+                    element.clear()
+                    if parents:
+                        parents[-1].remove(element)
+
+            if failed:
+                raise SubsonicError(None, "Request failed")
+
+    def iter_playlist(self, id: str) -> Iterator[Song]:
+        """Yields a Song model for every song in a playlist by its ID"""
+
+        for entry in self.iter_request(
+            "/getPlaylist", {**self.params, "id": id}, "entry"
+        ):
+            yield self.build_song(entry)
+
+    def iter_albums(
+        self, type: str = "alphabeticalByName", page_size: int = 500
+    ) -> Iterator[dict[str, str]]:
+        """Yields the raw attributes of every album on the server in the order of the given
+        getAlbumList2 type, one page at a time. Build models with build_album"""
+
+        offset = 0
+        while True:
+            count = 0
+            for album in self.iter_request(
+                "/getAlbumList2",
+                {**self.params, "type": type, "size": page_size, "offset": offset},
+                "album",
+            ):
+                count += 1
+                yield album
+            if count < page_size:
+                return
+            offset += count
 
     def build_url(self, subroute: str, params: dict) -> str:
         """
@@ -96,130 +462,335 @@ class Subsonic:
         return f"{self.url}/rest{subroute}?{urllib.parse.urlencode(params)}"
 
     def build_song(self, attrib: dict[str, str]) -> Song:
-        stream_url: str = self.build_url(
-            "/stream", {**self.params, "id": attrib.get("id")}
-        )
-
         # Make a model of only the necessary data of the song
         return Song(
             title=attrib.get("title"),
-            stream_url=stream_url,
-            artist=attrib.get("artist"),
-            album=attrib.get("album"),
+            artist=intern(attrib.get("artist")),
+            album=intern(attrib.get("album")),
             track=attrib.get("track"),
-            year=attrib.get("year"),
-            cover=self.build_url(
-                "/getCoverArt", {**self.params, "id": attrib.get("coverArt")}
-            ),
+            year=intern(attrib.get("year")),
             duration=attrib.get("duration"),
-            genre=attrib.get("genre"),
+            genre=intern(attrib.get("genre")),
             id=attrib.get("id"),
+            cover_id=attrib.get("coverArt"),
+            links=self.links,
         )
 
     def build_artist(self, attrib: dict[str, str], albums: list[dict]) -> Artist:
         return Artist(
             id=attrib.get("id"),
             name=attrib.get("name"),
-            albums=[self.build_album(album) for album in albums],
+            albums=tuple(self.build_album(album) for album in albums),
         )
 
     def build_album(self, attrib: dict[str, str]) -> Album:
         return Album(
             id=attrib.get("id"),
-            title=attrib.get("title"),
-            artist=attrib.get("artist"),
-            cover=self.build_url(
-                "/getCoverArt", {**self.params, "id": attrib.get("coverArt")}
-            ),
-            year=attrib.get("year"),
-            genre=attrib.get("genre"),
-            songs=(
-                [self.build_song(song) for song in attrib.get("songs")]
-                if attrib.get("songs")
-                else []
-            ),
+            # Albums from search3 and getAlbumList2 only carry a name
+            title=attrib.get("title", attrib.get("name")),
+            artist=intern(attrib.get("artist")),
+            year=intern(attrib.get("year")),
+            genre=intern(attrib.get("genre")),
+            songs=tuple(self.build_song(song) for song in attrib.get("songs") or ()),
+            cover_id=attrib.get("coverArt"),
+            links=self.links,
+        )
+
+    def hydrate(
+        self,
+        fetch: Callable[[str], T],
+        ids: list[str],
+        concurrency: int | None = None,
+        deadline: float | None = None,
+    ) -> list[T]:
+        """
+        Resolve a list of IDs with fetch concurrently, keeping the order of the IDs.
+
+        Lookups that fail or miss the deadline are logged and left out of the result.
+        """
+
+        results = fan_out(
+            fetch,
+            ids,
+            max_workers=concurrency or self.hydration_concurrency,
+            deadline=deadline if deadline is not None else self.hydration_deadline,
         )
 
+        hydrated: list[T] = []
+        for id, (result, exception) in zip(ids, results):
+            if exception is not None:
+                self.warn(f'Failed to hydrate "{id}": {exception}')
+            elif result is not None:
+                hydrated.append(result)
+
+        return hydrated
+
     def ping(self) -> bool:
         """Test if the server is only and return true only if the status is ok."""
 
-        response: ET.Element = self.xml_request("/ping", self.params)
         self.info("Requested ping to server")
-
-        if response.attrib["status"] == "ok":
-            self.info("Requested ping returned ok status")
-            return True
-        elif response.attrib["status"] == "failed":
-            self.warn("Requested ping returned failed status")
+        try:
+            self.data_request("/ping", self.params)
+        except SubsonicError as e:
+            self.warn(f"Requested ping returned failed status: {e}")
             return False
+        self.info("Requested ping returned ok status")
+        return True
+
+    def element_to_dict(self, element: ET.Element) -> dict:
+        """Flattens an element into its attributes, with the children grouped in lists by tag
+        name. This is the same shape as the JSON responses of the Subsonic API"""
+
+        data: dict = dict(element.attrib)
+        for child in element:
+            data.setdefault(child.tag.rpartition("}")[2], []).append(
+                self.element_to_dict(child)
+            )
+        return data
+
+    def cached(self, kind: str, id: str, subroute: str, cache: bool = True) -> dict:
+        """Fetch the raw data of an item by its ID through the metadata cache. Raises
+        SubsonicError if the server did not return the item, which is never cached"""
+
+        data: dict = self.metadata_cache.get_or_fetch(
+            f"{kind}:{id}",
+            lambda: self.data_request(subroute, {**self.params, "id": id}, kind),
+            bypass=not cache,
+        )
+        self.remember(kind, data)
+
+        return data
+
+    def remember(self, kind: str, data: dict) -> None:
+        """Add an item and the songs or albums it contains to the fuzzy index"""
+
+        self.fuzzy.add(kind, data)
+        # Songs have "album" and "artist" attributes, only albums and artists have children
+        child_kind = {"album": "song", "artist": "album"}.get(kind)
+        if child_kind is not None:
+            for child in data.get(child_kind, []):
+                self.fuzzy.add(child_kind, child)
+
+    def invalidate(self, kind: str | None = None, id: str | None = None) -> None:
+        """Drop cached metadata. Without a kind the whole cache is cleared, without an ID every
+        item of that kind is dropped"""
+
+        if kind is None:
+            self.metadata_cache.clear()
+        elif id is None:
+            self.metadata_cache.invalidate_prefix(f"{kind}:")
         else:
-            self.error("Requested ping returned an unexpected status value")
-            return False
+            self.metadata_cache.invalidate(f"{kind}:{id}")
 
-    def get_album(self, id: str) -> Album:
-        """Generates an Album model"""
+    def get_album(self, id: str, cache: bool = True) -> Album | None:
+        """Generates an Album model, or None if the server did not return the album"""
 
-        album_data: ET.Element = self.xml_request(
-            "/getAlbum", {**self.params, "id": id}
-        )[0]
+        try:
+            album_data: dict = self.cached("album", id, "/getAlbum", cache)
+        except SubsonicError as e:
+            self.warn(f'Failed to get the album "{id}": {e}')
+            return None
 
-        album_songs: list[Song] = [self.build_song(song.attrib) for song in album_data]
+        return self.build_full_album(album_data)
+
+    def build_full_album(self, album_data: dict) -> Album:
+        """Generates an Album model with its songs from a /getAlbum payload"""
+
+        album_songs: tuple[Song, ...] = tuple(
+            self.build_song(song) for song in album_data.get("song", [])
+        )
 
         album = Album(
-            id=album_data.attrib["id"],
-            title=album_data.attrib["name"],
-            artist=album_data.attrib["artist"],
-            cover=self.build_url(
-                "/getCoverArt", {**self.params, "id": album_data.attrib["coverArt"]}
-            ),
+            id=album_data["id"],
+            title=album_data["name"],
+            # Only the ID and name of an album are always present
+            artist=intern(album_data.get("artist")),
             songs=album_songs,
-            year=album_data.attrib["year"],
-            genre=album_data.attrib["genre"],
+            year=intern(album_data.get("year")),
+            genre=intern(album_data.get("genre")),
+            cover_id=album_data.get("coverArt"),
+            links=self.links,
         )
 
         return album
 
-    def get_song(self, id: str) -> Song:
-        """Generates a Song model by its ID"""
+    def get_song(self, id: str, cache: bool = True) -> Song | None:
+        """Generates a Song model by its ID, or None if the server did not return the song"""
 
-        song_data: ET.Element = self.xml_request("/getSong", {**self.params, "id": id})[
-            0
-        ]
+        try:
+            song_data: dict = self.cached("song", id, "/getSong", cache)
+        except SubsonicError as e:
+            self.warn(f'Failed to get the song "{id}": {e}')
+            return None
 
-        song = self.build_song(song_data.attrib)
+        song = self.build_song(song_data)
 
         return song
 
-    def get_artist(self, id: str) -> Artist:
-        """Generates an Artist model by its ID"""
-
-        artist_data: ET.Element = self.xml_request(
-            "/getArtist", {**self.params, "id": id}
-        )[0]
+    def get_artist(self, id: str, cache: bool = True) -> Artist | None:
+        """Generates an Artist model by its ID, or None if the server did not return the
+        artist"""
 
-        ns = {"ns0": "http://subsonic.org/restapi"}
-        album_elems = artist_data.findall("ns0:album", ns)
-        albums = [album.attrib for album in album_elems]
+        try:
+            artist_data: dict = self.cached("artist", id, "/getArtist", cache)
+        except SubsonicError as e:
+            self.warn(f'Failed to get the artist "{id}": {e}')
+            return None
 
-        artist = self.build_artist(artist_data, albums)
+        artist = self.build_artist(artist_data, artist_data.get("album", []))
 
         return artist
 
+    def search3(
+        self,
+        query: str,
+        song_count: int = 20,
+        album_count: int = 20,
+        artist_count: int = 20,
+        cache: bool = True,
+    ) -> dict[str, list[dict[str, str]]]:
+        """Send a single /search3 request and sort the matches by type in one pass over the
+        response. Returns the raw attributes of the songs, albums and artists.
+
+        Searches are answered by the local library mirror instead once it has been synced
+        """
+
+        counts = (song_count, album_count, artist_count)
+        if cache:
+            buckets = self.local_search(query, counts)
+            if buckets is not None:
+                return buckets
+
+        # The matches are grouped by type while the response is converted
+        try:
+            search_results: dict = self.data_request(
+                "/search3",
+                {
+                    **self.params,
+                    "query": query,
+                    "songCount": song_count,
+                    "albumCount": album_count,
+                    "artistCount": artist_count,
+                },
+                "searchResult3",
+            )
+        except SubsonicError as e:
+            # Only a definitive not found is an empty result, other errors are not cached
+            if e.code != NOT_FOUND:
+                raise
+            search_results = {}
+
+        return self.store_search(query, counts, search_results)
+
+    def local_search(
+        self, query: str, counts: tuple[int, int, int]
+    ) -> dict[str, list[dict[str, str]]] | None:
+        """Answer a search from the library mirror or the search cache, without contacting
+        the server. Returns None if neither can"""
+
+        if self.library is not None and self.library.ready:
+            buckets = self.library.search(query, *counts)
+            self.fuzzy.add_all(buckets)
+            return buckets
+
+        cached = self.search_cache.get(query, counts)
+        return cached if cached is not MISSING else None
+
+    def store_search(
+        self, query: str, counts: tuple[int, int, int], search_results: dict
+    ) -> dict[str, list[dict[str, str]]]:
+        """Sort a searchResult3 payload by type and remember it for later searches"""
+
+        buckets: dict[str, list[dict[str, str]]] = {
+            kind: search_results.get(kind, []) for kind in ("song", "album", "artist")
+        }
+
+        self.search_cache.set(query, counts, buckets)
+        self.fuzzy.add_all(buckets)
+
+        return buckets
+
+    def search_all(
+        self,
+        query: str,
+        song_count: int = 20,
+        album_count: int = 20,
+        artist_count: int = 20,
+    ) -> SearchResult:
+        """Search songs, albums and artists with a single request and returns a SearchResult
+        model. Artists only contain the albums that were matched by the same search"""
+
+        self.info(f'Searching everything with the query "{query}"')
+
+        buckets = self.search3(query, song_count, album_count, artist_count)
+
+        return self.build_search_result(buckets)
+
+    def build_search_result(
+        self, buckets: dict[str, list[dict[str, str]]]
+    ) -> SearchResult:
+        """Generates a SearchResult model from the buckets of search3"""
+
+        albums_by_artist: dict[str, list[dict[str, str]]] = {}
+        for album in buckets["album"]:
+            albums_by_artist.setdefault(album.get("artistId"), []).append(album)
+
+        result = SearchResult(
+            songs=tuple(self.build_song(song) for song in buckets["song"]),
+            albums=tuple(self.build_album(album) for album in buckets["album"]),
+            artists=tuple(
+                self.build_artist(artist, albums_by_artist.get(artist.get("id"), []))
+                for artist in buckets["artist"]
+            ),
+        )
+        self.info(
+            f"Matched {len(result.songs)} songs, {len(result.albums)} albums "
+            f"and {len(result.artists)} artists"
+        )
+
+        return result
+
+    def match_song(self, query: str) -> Song | None:
+        """Match a song with a possibly misspelled query against the songs the client has
+        already seen, for queries the server search found nothing for. Returns None if
+        nothing is close enough"""
+
+        matches = self.fuzzy.search(query, "song", threshold=self.fuzzy_threshold)
+        if not matches:
+            return None
+
+        score, attrib = matches[0]
+        self.info(
+            f'Fuzzy matched the song "{attrib.get("title")}" with a score of {score:.2f}'
+        )
+
+        return self.get_song(attrib["id"])
+
+    def match_album(self, query: str) -> Album | None:
+        """Match an album with a possibly misspelled query against the albums the client has
+        already seen, for queries the server search found nothing for, and returns it with
+        its songs. Returns None if nothing is close enough"""
+
+        matches = self.fuzzy.search(query, "album", threshold=self.fuzzy_threshold)
+        if not matches:
+            return None
+
+        score, attrib = matches[0]
+        self.info(
+            f'Fuzzy matched the album "{attrib.get("name")}" with a score of {score:.2f}'
+        )
+
+        return self.get_album(attrib["id"])
+
     def search_song(self, query: str, single: bool = True) -> list[Song] | None:
         """Search a song with a query and generates a Song model with the first result or None if
         no one is found"""
 
         self.info(f'Searching a song with the query "{query}"')
 
-        search_results: ET.Element = self.xml_request(
-            "/search3", {**self.params, "query": query}
-        )[0]
-
-        only_songs_results: list[ET.Element] = [
-            result
-            for result in search_results
-            if result.tag == "{http://subsonic.org/restapi}song"
-        ]
+        only_songs_results: list[dict[str, str]] = self.search3(
+            query, album_count=0, artist_count=0
+        )["song"]
 
         # Return None if no song is found
         if not only_songs_results:
@@ -227,7 +798,7 @@ class Subsonic:
             return None
 
         if single:
-            first_song_result_metadata = only_songs_results[0].attrib
+            first_song_result_metadata = only_songs_results[0]
 
             # Make a model of only the necessary data of the song
             song: Song = self.build_song(first_song_result_metadata)
@@ -235,9 +806,7 @@ class Subsonic:
 
             return [song]
         else:
-            songs: list[Song] = [
-                self.build_song(song.attrib) for song in only_songs_results
-            ]
+            songs: list[Song] = [self.build_song(song) for song in only_songs_results]
             self.info(f"Matched {len(songs)} songs")
             return songs
 
@@ -249,15 +818,9 @@ class Subsonic:
 
         self.info(f'Searching an album with the query "{query}"')
 
-        search_results: ET.Element = self.xml_request(
-            "/search3", {**self.params, "query": query}
-        )[0]
-
-        only_albums_results: list[ET.Element] = [
-            result
-            for result in search_results
-            if result.tag == "{http://subsonic.org/restapi}album"
-        ]
+        only_albums_results: list[dict[str, str]] = self.search3(
+            query, song_count=0, artist_count=0
+        )["album"]
 
         # Return None if no album is found
         if not only_albums_results:
@@ -265,7 +828,7 @@ class Subsonic:
             return None
 
         if single:
-            first_album_result_metadata = only_albums_results[0].attrib
+            first_album_result_metadata = only_albums_results[0]
 
             # Make a model of only the necessary data of the album
             album: Album = self.build_album(first_album_result_metadata)
@@ -273,8 +836,10 @@ class Subsonic:
 
             return album
 
-        self.info(f'Matched the album "{only_albums_results[0].attrib["name"]}"')
-        albums = [self.get_album(album.attrib["id"]) for album in only_albums_results]
+        self.info(f'Matched the album "{only_albums_results[0]["name"]}"')
+        albums = self.hydrate(
+            self.get_album, [album["id"] for album in only_albums_results]
+        )
 
         return albums
 
@@ -284,15 +849,9 @@ class Subsonic:
 
         self.info(f'Searching an artist with the query "{query}"')
 
-        search_results: ET.Element = self.xml_request(
-            "/search3", {**self.params, "query": query}
-        )[0]
-
-        only_artists_results: list[ET.Element] = [
-            result
-            for result in search_results
-            if result.tag == "{http://subsonic.org/restapi}artist"
-        ]
+        only_artists_results: list[dict[str, str]] = self.search3(
+            query, song_count=0, album_count=0
+        )["artist"]
 
         # Return None if no artist is found
         if not only_artists_results:
@@ -300,41 +859,29 @@ class Subsonic:
             return None
 
         # search for albums by artists
-        artists: list[Artist] = [
-            self.get_artist(artist.attrib["id"]) for artist in (only_artists_results)
-        ]
+        artists: list[Artist] = self.hydrate(
+            self.get_artist, [artist["id"] for artist in only_artists_results]
+        )
         return artists
 
+    def get_playlist(self, id: str) -> list[Song]:
+        """Generates a list of Song models with all the songs in a playlist by its ID"""
+
+        return list(self.iter_playlist(id))
+
     def search_playlist(self, query: str) -> list[Song] | None:
         """Search a playlist with a query and returns a list of Song models with all the songs
-        in the album or None is no playlist is found"""
+        in the playlist or None is no playlist is found"""
 
         self.info(f'Searching a playlist with the query "{query}"')
-        playlists_list: ET.Element = self.xml_request("/getPlaylists", self.params)[0]
 
-        matched_playlist: str
-        for playlist_element in playlists_list:
-            if query in playlist_element.attrib["name"]:
-                matched_playlist = playlist_element.attrib
-                break
+        matched_playlist: dict | None = self.playlists.find(query)
 
-        if matched_playlist["id"] is None:
+        if matched_playlist is None:
             self.warn("No playlist has been matched")
             return None
 
-        playlist: ET.Element = self.xml_request(
-            "/getPlaylist", {**self.params, "id": matched_playlist["id"]}
-        )[0]
-
-        only_entries: list[ET.Element] = [
-            data
-            for data in playlist
-            if data.tag == "{http://subsonic.org/restapi}entry"
-        ]
-
-        song_list: list[Song] = [
-            self.build_song(entry.attrib) for entry in only_entries
-        ]
+        song_list: list[Song] = self.get_playlist(matched_playlist["id"])
 
         self.info(f'Matched the playlist "{matched_playlist["name"]}"')
 
@@ -343,23 +890,49 @@ class Subsonic:
     def get_now_playing(self) -> Song | None:
         """Get the song that is currently playing on the server"""
 
-        now_playing: ET.Element = self.xml_request("/getNowPlaying", self.params)[0]
+        now_playing: dict = self.data_request(
+            "/getNowPlaying", self.params, "nowPlaying"
+        )
 
-        if len(now_playing) == 0:
+        if not now_playing.get("entry"):
             self.warn("No song currently playing")
             return None
 
-        song: Song = self.build_song(now_playing[0].attrib)
+        song: Song = self.build_song(now_playing["entry"][0])
 
         self.info(f'Now playing "{song.title}"')
 
         return song
 
-    def scrobble(self, id: str, submission: bool) -> None:
-        """Scrobble a song by its ID"""
+    def scrobble(self, id: str, submission: bool) -> bool:
+        """Scrobble a song by its ID, returns False if the server rejected it"""
 
         self.info(f'Scrobbling song with ID "{id}"')
 
-        self.xml_request(
-            "/scrobble", {**self.params, "id": id, "submission": submission}
-        )
+        try:
+            self.data_request(
+                "/scrobble", {**self.params, "id": id, "submission": submission}
+            )
+        except SubsonicError:
+            return False
+        return True
+
+    def scrobble_many(self, submissions: list[tuple[str, int]]) -> bool:
+        """Submit several plays in one request, as (ID, time in milliseconds) pairs. Returns
+        False if the server rejected them"""
+
+        self.info(f"Submitting {len(submissions)} scrobble(s)")
+
+        try:
+            self.data_request(
+                "/scrobble",
+                {
+                    **self.params,
+                    "id": [id for id, _ in submissions],
+                    "time": [time for _, time in submissions],
+                    "submission": True,
+                },
+            )
+        except SubsonicError:
+            return False
+        return True
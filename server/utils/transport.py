@@ -0,0 +1,98 @@
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Routes that change state on the server. They are never retried automatically, as a retry
+# after a read timeout could apply the change twice.
+NON_IDEMPOTENT_ROUTES: frozenset[str] = frozenset(
+    {
+        "/scrobble",
+        "/star",
+        "/unstar",
+        "/setRating",
+        "/createPlaylist",
+        "/updatePlaylist",
+        "/deletePlaylist",
+    }
+)
+
+
+class Transport:
+    """Pooled keep-alive HTTP transport used to talk to the Subsonic server"""
+
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int = 10,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10,
+        retries: int = 3,
+        backoff: float = 0.3,
+    ) -> None:
+        self.base_url: str = base_url
+        self.timeout: tuple[float, float] = (connect_timeout, read_timeout)
+        self.session: requests.Session = requests.Session()
+
+        retrying = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset({"GET", "HEAD"}),
+            ),
+        )
+        once = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+
+        self.adapters: list[HTTPAdapter] = [retrying, once]
+        self.session.mount("http://", retrying)
+        self.session.mount("https://", retrying)
+        # requests picks the adapter with the longest matching prefix
+        for route in NON_IDEMPOTENT_ROUTES:
+            self.session.mount(f"{self.base_url}/rest{route}", once)
+
+        self._lock: Lock = Lock()
+        self.requests: int = 0
+
+    def get(self, subroute: str, params: dict, **kwargs) -> requests.Response:
+        """
+        Send a GET request to the Subsonic REST API over the pooled session.
+
+        Subroute should come in the format of /subroute, with the slash ahead of it.
+        """
+
+        with self._lock:
+            self.requests += 1
+
+        return self.session.get(
+            f"{self.base_url}/rest{subroute}",
+            params=params,
+            timeout=kwargs.pop("timeout", self.timeout),
+            **kwargs,
+        )
+
+    def stats(self) -> dict[str, int]:
+        """Connection usage of the pools, reused is the number of requests that skipped a handshake"""
+
+        connections = 0
+        pooled_requests = 0
+        for adapter in self.adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                pooled_requests += pool.num_requests
+
+        return {
+            "requests": self.requests,
+            "connections": connections,
+            "reused": max(pooled_requests - connections, 0),
+        }
+
+    def close(self) -> None:
+        self.session.close()